@@ -1,12 +1,70 @@
 """
 Python class representing the Agilent4395A Frequency Response Analyzer
 """
-import cmath
 import datetime
 import sys
 import visa
 
-from draw import draw
+import numpy as np
+
+# Results of an impedance sweep (see Agilent4395A.measureImpedance): frequency (Hz),
+# channel A and B voltages and the impedance Z = Rs (Va - Vb) / Vb
+SWEEP_DTYPE = np.dtype([("freq", "f8"), ("Va", "c16"), ("Vb", "c16"), ("Z", "c16")])
+
+SWEEP_COLUMNS = "Frequency,Va (real),Va (imag),Vb (real),Vb (imag),Va Mag,Va Phase,Vb Mag,Vb Phase,Impedance Mag,Impedance Phase"
+
+# Builds the structured array of a sweep from the frequencies and (complex) channel voltages
+def impedanceSweep(freqs, Va, Vb, Rs):
+    sweep = np.empty(len(freqs), dtype=SWEEP_DTYPE)
+    sweep["freq"] = freqs
+    sweep["Va"]   = Va
+    sweep["Vb"]   = Vb
+    sweep["Z"]    = Rs * (sweep["Va"] - sweep["Vb"]) / sweep["Vb"]
+    return sweep
+
+# Returns the lines describing a sweep at the top of a results file
+def sweepHeader(Rs, f1, f2, nPoints, power, bandwidth="auto"):
+    return ["Impedance Measurement Performed with an Agilent 4395A Network Analyzer",
+            "File generated on: {}".format(datetime.datetime.now().isoformat()),
+            "Rs = {} ohms".format(Rs),
+            "Impedance Calculation: Rs x (Va - Vb) / Vb",
+            "Start Frequency: {} Hz".format(f1),
+            "Stop  Frequency: {} Hz".format(f2),
+            "Number of data points: {}".format(nPoints),
+            "Source Power (dB): {}".format(power),
+            "Measurement BW: {} ".format(bandwidth),
+            "",     # Store additional info here
+            ""]     # Store additional info here
+
+# Computes the scalar trace formats (as read with FMT LINM, PHAS, REAL, IMAG, LOGM) from a
+# complex trace, returned as a dict of numpy arrays. Phase is in degrees (PHAU DEG)
+def formatTrace(trace):
+    mag = np.abs(trace)
+    return {
+        "LINM": mag,
+        "PHAS": np.angle(trace, deg=True),
+        "REAL": trace.real,
+        "IMAG": trace.imag,
+        "LOGM": 20 * np.log10(mag),
+    }
+
+# Writes a sweep to a csv file: the header lines, then one row per frequency with the real and
+# imaginary parts of Va and Vb, and the magnitude and phase (degrees) of Va, Vb and Z
+# formats adds columns with other trace formats (see formatTrace) of Va, Vb and Z, e.g. ["LOGM"]
+def writeSweep(filename, sweep, header, formats=()):
+    traces  = dict((name, formatTrace(sweep[name])) for name in ["Va", "Vb", "Z"])
+    columns = [sweep["freq"], traces["Va"]["REAL"], traces["Va"]["IMAG"], traces["Vb"]["REAL"], traces["Vb"]["IMAG"]]
+    for name in ["Va", "Vb", "Z"]:
+        columns += [traces[name]["LINM"], traces[name]["PHAS"]]
+
+    titles = SWEEP_COLUMNS
+    for fmt in formats:
+        for name in ["Va", "Vb", "Z"]:
+            columns.append(traces[name][fmt])
+            titles += ",{} {}".format(name if name != "Z" else "Impedance", fmt)
+
+    np.savetxt(filename, np.column_stack(columns), fmt="%.12g", delimiter=",",
+               header="\n".join(header + [titles]), comments="")
 
 # Controller class for the Agilent 4395A Frequency Response Analyzer
 #   - operates over GPIB using a National Instruments USB-GPIB cable
@@ -24,9 +82,17 @@ class Agilent4395A:
     # GPIB ID string, returned by the '*IDN?' query, used to test if connection is successful
     ID = u'HEWLETT-PACKARD,4395A,MY41101925,REV1.12\n'
 
+    # Data transfer formats for traces: ASCII (FORM4, the default after reset) or
+    # IEEE 64-bit floating point binary blocks (FORM3)
+    DATA_FORMATS = {"ascii": "FORM4", "binary": "FORM3"}
+
+    # Extra time (s) allowed for a sweep to finish, on top of the sweep time
+    SWEEP_MARGIN = 10
+
     def __init__(self):
         self.rm = visa.ResourceManager()
         self.analyzer = None
+        self.dataFormat = "ascii"
 
     # Connect to and initialize the analyzer
     def connect(self):
@@ -56,11 +122,99 @@ class Agilent4395A:
     def query(self, cmd):
         return self.analyzer.query(cmd)
 
+    # Waits until all pending operations (configuration commands, sweeps) are finished, using
+    # the '*OPC?' query which the analyzer only answers once they are done
+    # timeout is in seconds, default is the current timeout of the connection
+    def waitComplete(self, timeout=None):
+        previous = self.analyzer.timeout
+        if timeout is not None:
+            self.analyzer.timeout = 1000 * timeout
+        try:
+            self.query("*OPC?")
+        finally:
+            self.analyzer.timeout = previous
+
+    # Returns the sweep time in seconds
+    def getSweepTime(self):
+        return float(self.query("SWET?"))
+
+    # Makes a single sweep (or groups of sweeps when averaging), returns when it is finished
+    def sweep(self, groups=1):
+        timeout = groups * self.getSweepTime() + self.SWEEP_MARGIN
+        self.write("SING" if groups == 1 else "NUMG {}".format(groups))
+        self.waitComplete(timeout)
+
+    # Sets the transfer format used by trace and sweep parameter queries, "ascii" or "binary"
+    def setDataFormat(self, dataFormat):
+        self.write(self.DATA_FORMATS[dataFormat])
+        self.dataFormat = dataFormat
+
+    # Sends a query whose response is a list of numbers, returns a numpy array
+    # Binary responses are IEEE 488.2 definite length blocks of big-endian 64-bit floats
+    def queryValues(self, cmd):
+        if self.dataFormat == "binary":
+            return self.analyzer.query_binary_values(cmd, datatype='d', is_big_endian=True, container=np.array)
+        return np.array(self.query(cmd).strip().split(","), dtype=float)
+
+    # Reads the active trace as complex values, the trace format must be complex (FMT POLA)
+    # so that the analyzer sends real,imaginary pairs. Other formats are derived with formatTrace
+    def readComplexTrace(self):
+        values = self.queryValues("OUTPDTRC?")
+        return values[::2] + 1j * values[1::2]
+
+    # Reads the x-axis values (frequency points) of the sweep
+    def readFrequencies(self):
+        return self.queryValues("OUTPSWPRM?")
+
+    # Configures both channels for a logarithmic impedance sweep
+    #   nPoints    number of points for the sweep (max 801)
+    #   f1, f2     start and stop frequency in Hz
+    #   bandwidth  measurement (IF) bandwidth in Hz, or "AUTO"
+    #   power      source power in dB
+    #   dataFormat transfer format of the results, "binary" or "ascii"
+    def configureSweep(self, nPoints, f1, f2, bandwidth="AUTO", power=0, dataFormat="binary"):
+        if not (1 <= nPoints <= 801):
+            raise ValueError("nPoints must be in the range [1, 801]")
+        if not (f1 < f2):
+            raise ValueError("f1 must be less than f2")
+        if not (10 <= f1 <= 510000000 and 10 <= f2 <= 510000000):
+            raise ValueError("start/stop frequencies must be in the range [10, 510M]")
+
+        bandwidth = "BWAUTO 1" if str(bandwidth).upper() == "AUTO" else "BW {}".format(bandwidth)
+        commands = ["NA", "CHAN1", "HOLD", "SWPT LOGF", bandwidth, "POIN {}".format(nPoints),
+                    "MEAS {}", "PHAU DEG", "STAR {} HZ".format(f1), "STOP {} HZ".format(f2),
+                    "POWE {}".format(power), "FMT LINM"]
+
+        # repeat configuration per channel
+        for channel in ["A", "B"]:
+            for command in commands:
+                self.write(command.format(channel) if command == "MEAS {}" else command)
+            self.waitComplete()
+        self.setDataFormat(dataFormat)
+
+    # Sweeps channels A and B (after configureSweep) and returns the results as an array of
+    # SWEEP_DTYPE, with impedance calculated for a sensing resistor of Rs ohms
+    # power sets the source power (dB) first if given
+    def measureImpedance(self, Rs, power=None):
+        if power is not None:
+            self.write("POWE {}".format(power))
+            self.waitComplete()
+
+        traces = {}
+        for channel in ["A", "B"]:
+            self.write("MEAS {}".format(channel))
+            self.write("FMT POLA")
+            self.waitComplete()
+            self.sweep()
+            traces[channel] = self.readComplexTrace()
+
+        return impedanceSweep(self.readFrequencies(), traces["A"], traces["B"], Rs)
+
 if __name__ == "__main__":
 
-    # Test script, sends some configuration commands and reads the measured data
+    # Test script, measures impedance over a frequency range and plots the results
 
-    import time
+    from draw import draw
 
     fra = Agilent4395A()
 
@@ -69,9 +223,6 @@ if __name__ == "__main__":
         print "Failed to connect to Agilent4395A"
         exit(1)
 
-    # dictionaries to store measurements
-    results = {"A": {}, "B": {}}
-    channels = ["A", "B"]
     filename = sys.argv[1]
 
     # Setup parameters
@@ -85,125 +236,19 @@ if __name__ == "__main__":
     if len(sys.argv) == 3:
         power = eval(sys.argv[2])
 
-    # Validate parameters
-    if not (1 <= nPoints <= 801):
-        print "nPoints must be in the range [0, 801]"
-        exit()
-
-    if not (f1 < f2):
-        print "f1 must be less than f2"
-        exit()
-
-    if not (10 <= f1 <= 510000000):
-        print "start/stop frequencies must be in the range [10, 510M]"
-        exit()
-
-    if not (10 <= f2 <= 510000000):
-        print "start/stop frequencies must be in the range [10, 510M]"
-        exit()
-
-    # BWAUTO 1
-    fmts = ["LINM", "PHAS", "REAL", "IMAG", "LOGM"]
-    commands = """NA
-        CHAN1
-        HOLD
-        SWPT LOGF
-        BWAUTO 1
-        POIN {}
-        FORM4
-        MEAS {{}}
-        PHAU DEG
-        STAR {} HZ
-        STOP {} HZ
-        POWE {}
-        FMT LINM""".format(nPoints, f1, f2, power)
-
-    for channel in channels:
-        #print "press enter to measure channel {}".format(channel), raw_input()
-
-        # Configure analyzer for measurements
-        print "Configuring analyzer for measurement of channel {}".format(channel)
-        commandList = commands.format(channel).split("\n")
-        for cmd in commandList:
-            fra.write(cmd.strip())
-        time.sleep(15)
-
-        # Get sweep duration
-        t = 10
-        try:
-            duration = fra.query("SWET?").strip()
-            t = float(duration)
-        except:
-            print "failed to convert to float: ", duration
-            t = 180
-        print "sweep time: {}".format(t)
-
-        # Make measurement
-        t0 = time.time()
-        fra.write("SING")
-        while time.time() < t0 + t + 2:
-            print "waiting"
-            time.sleep(1)
-
-        # Read data from analyzer
-        for fmt in fmts:
-            print "Reading Channel {}: {} ...".format(channel, fmt),
-            fra.write("FMT {}".format(fmt))
-
-            # results are read as list of x1,y1,x2,y2,x3,y3... where every yn value is 0.
-            # this line splits the list at every comma, strips out every second value, and converts to floats
-            response = fra.query("OUTPDTRC?")
-            print "done - {} bytes".format(len(response))
-            results[channel][fmt] = map(float, response.strip().split(",")[::2])
-
-    # Read x-axis values (frequency points)
-    freqs = fra.query("OUTPSWPRM?").strip()
-    freqs = map(float, freqs.split(","))
-
-    timestamp = datetime.datetime.now().isoformat()
+    print "Configuring analyzer"
+    fra.configureSweep(nPoints, f1, f2, bandwidth="AUTO", power=power)
+    print "sweep time: {}".format(fra.getSweepTime())
+
+    print "Measuring channels A and B ..."
+    sweep = fra.measureImpedance(Rs)
 
     print "saving file"
     filename = "sweepResults_{}.csv".format(filename)
-    output = open(filename, "w")
-    output.write("Impedance Measurement Performed with an Agilent 4395A Network Analyzer\n")
-    output.write("File generated on: {}\n".format(timestamp))
-    output.write("Rs = {} ohms\n".format(Rs))
-    output.write("Impedance Calculation: Rs x (Va - Vb) / Vb\n")
-    output.write("Start Frequency: {} Hz\n".format(f1))
-    output.write("Stop  Frequency: {} Hz\n".format(f2))
-    output.write("Number of data points: {}\n".format(nPoints))
-    output.write("Source Power (dB): {}\n".format(power))
-    output.write("Measurement BW: auto \n")
-    output.write("\n") # Store additional info here
-    output.write("\n") # Store additional info here
-    output.write("Frequency,Va (real),Va (imag),Vb (real),Vb (imag),Va Mag,Va Phase,Vb Mag,Vb Phase,Impedance Mag,Impedance Phase\n")
-
-    for i in range(nPoints):
-        freq   = freqs[i]
-        VaReal = results["A"]["REAL"][i]
-        VaImag = results["A"]["IMAG"][i]
-        VbReal = results["B"]["REAL"][i]
-        VbImag = results["B"]["IMAG"][i]
-        Va     = VaReal + 1j * VaImag
-        Vb     = VbReal + 1j * VbImag
-        Z      = Rs * (Va - Vb) / Vb
-        VaMag, VaPhase = cmath.polar(Va)
-        VbMag, VbPhase = cmath.polar(Vb)
-        ZMag, ZPhase   = cmath.polar(Z)
-        VaPhase        = 180 * VaPhase / cmath.pi
-        VbPhase        = 180 * VbPhase / cmath.pi
-        ZPhase         = 180 * ZPhase / cmath.pi
-
-        output.write("{},{},{},{},{},{},{},{},{},{},{}\n".format(
-            freq, VaReal, VaImag, VbReal, VbImag,
-            VaMag, VaPhase, VbMag, VbPhase, ZMag, ZPhase))
-
-    output.close()
+    writeSweep(filename, sweep, sweepHeader(Rs, f1, f2, nPoints, power))
 
     fra.disconnect()
 
-    #time.sleep(1)
-
     draw(filename)
 
-    exit()
\ No newline at end of file
+    exit()
@@ -3,18 +3,21 @@ import numpy as np
 import datetime
 import matplotlib.dates as mdates
 from scipy import interpolate
-from pandas import DataFrame, read_csv, to_datetime, concat, Timedelta, to_numeric
+from pandas import DataFrame, to_datetime, concat, Timedelta, to_numeric
 from sys import version_info
 
+from DataLog import readLog
+
 class ColumnPlotter:
     """ plotting various  """
 
-    def __init__(self, columnFile):
+    def __init__(self, columnFile, geometry=None):
+        self.geometry = geometry    # ColumnUtils.ThermistorGeometry, needed for positionPlot
         self.loadData(columnFile)
 
     def loadData(self, columnFile):
-        """ reads processed data and saves it as a pandas dataframe """
-        df = read_csv(columnFile)
+        """ reads processed data (csv or binary log) and saves it as a pandas dataframe """
+        df = readLog(columnFile)
         df['Timestamp'] = to_datetime(df['Timestamp'])
         self.data = df
         self.__splitData()
@@ -170,6 +173,33 @@ class ColumnPlotter:
 
         plt.show()
 
+    def positionPlot(self, timestamp=None):
+        """ plots the temperature of each thermistor at its position in the column, at one time (default: last) """
+        if self.geometry is None:
+            raise ValueError("positionPlot needs the thermistor geometry (see ColumnExperiment.readConfig)")
+
+        df = self.tmp
+        if timestamp is None:
+            timestamp = df['Timestamp'].max()
+        df = df[df['Timestamp'] == to_datetime(timestamp)]
+        df = df[df['name'].isin(self.geometry.index)]
+
+        # set up plot
+        fig = plt.figure(figsize=(6, 8))
+        ax1 = fig.add_subplot(111)
+
+        # add data
+        cs = ax1.scatter(self.geometry.getColumn(df['name'].values), self.geometry.getHeight(df['name'].values),
+                         c=df['value'], cmap=plt.cm.coolwarm, s=200)
+        fig.colorbar(cs, label='Temperature (C)')
+
+        # axis labels
+        ax1.set_title(str(timestamp))
+        ax1.set_xlabel('Column')
+        ax1.set_ylabel('Height (cm)')
+
+        plt.show()
+
     def threeD(self):
         """ an interactive 3d plot"""
         pass
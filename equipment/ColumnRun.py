@@ -8,6 +8,8 @@ import numpy as np
 from LaudaRP845     import LaudaRP845
 from Keysight34972A import Keysight34972A
 from ColumnUtils    import Thermistor, getChannels, getChannelName
+from DataLog        import openLog, exportCsv, FORMATS
+from SerialIO       import runAll
 from itertools      import izip
 from pyEmail        import Emailer
 
@@ -66,7 +68,9 @@ parser.add_argument('--disc_low',  default=dflt_disc_low,  type=int, help="Sampl
 parser.add_argument('--rdelay',    default=dflt_rdelay,    type=int, help="Wait time (s) between thermistor (DAQ) and cooling bath measurements")
 parser.add_argument('--channels',  default=dflt_channels,    help="List of DAQ channels to read, see code for detailed documentation on format")
 parser.add_argument('--filename',  help="Filename of output csv file (.csv extention added automatically)")
+parser.add_argument('--format',    default="csv", choices=FORMATS, help="Output file format. 'binary' writes chunked float64 logs (.npl directories) that load much faster than csv")
 parser.add_argument('--calib',     default=dflt_calib,     help="Filename of thermistor calibration file")
+parser.add_argument('--lut',       action='store_true',    help="Convert resistances with precomputed lookup tables (cached next to the calibration file)")
 
 # Email control
 parser.add_argument('--email',     default="",                        help="Send results to this email")
@@ -157,6 +161,9 @@ if channelList:
     if not Therm.hasCalibration(channelNames.values()):
         print("Missing calibration data for thermistors!")
         exit(1)
+    if args.lut:
+        Therm.buildTables(thermistorNames)
+        print("Lookup tables built, max. error {:.1e} K".format(float(Therm.tables['error'])))
 
 # Prepare files for writing
 filename  = ""
@@ -166,19 +173,15 @@ else:
     timestamp = datetime.datetime.now().isoformat().split('.')[0].replace(':', '_')
     filename  = "{}_ColumnRun".format(timestamp)
 
-commonHdrs = 'Timestamp,upperBathTemp,upperExtTemp,upperTarget,lowerBathTemp,lowerExtTemp,lowerTarget'
+commonHdrs = ['Timestamp', 'upperBathTemp', 'upperExtTemp', 'upperTarget', 'lowerBathTemp', 'lowerExtTemp', 'lowerTarget']
 
 # Write resistances file
-output = open("{}_res.csv".format(filename), "w")
-output.write("{},{}\n".format(commonHdrs,",".join(thermistorNames)))
-output.close()
+resLog = openLog("{}_res".format(filename), commonHdrs + thermistorNames, fmt=args.format)
 
 # Write temperatures file
 tmp_stdev = ['{}_stdev'.format(x) for x in thermistorNames]
 headers = [val for pair in izip(thermistorNames, tmp_stdev) for val in pair]
-output = open("{}_tmp.csv".format(filename), "w")
-output.write("{},{}\n".format(commonHdrs, ",".join(headers)))
-output.close()
+tmpLog = openLog("{}_tmp".format(filename), commonHdrs + headers, fmt=args.format)
 
 # Wait...
 if args.idelay:
@@ -202,53 +205,66 @@ if low:
 # Start recording
 for t in range(0, duration + readDelay, readDelay):
     t0 = time.time()
-    currentTime = datetime.datetime.now().isoformat()
+    currentTime = time.time()
     status = '\r{:2.0f}% complete.  Status: '.format(100. * t / (duration + readDelay))
     # read DAQ
     if channelList:
         print("{} Measuring DAQ".format(status).ljust(80)),
         daqVals   = daq.readResistances(channelList)
 
-        daqValsTmp = [Therm.calculateTemperature(res, name) for (res, name) in izip(daqVals, thermistorNames)]
-        daqValsTmp = [x - 273.15 for x in daqValsTmp] # convert to degrees C
-        err = [Therm.calculateUncertainty(res, name) for (res, name) in izip(daqVals, thermistorNames)]
+        if args.lut:
+            daqValsTmp = Therm.lookupTemperatures(daqVals, thermistorNames)
+        else:
+            daqValsTmp = Therm.calculateTemperatures(daqVals, thermistorNames)
+        daqValsTmp = daqValsTmp - 273.15 # convert to degrees C
+        err        = Therm.calculateUncertainties(daqVals, thermistorNames)
         daqValsTmp = [val for pair in izip(daqValsTmp, err) for val in pair]
-        daqVals      = ",".join(map(str, daqVals))
-        daqValsTmp   = ",".join(map(str, daqValsTmp))
     else:
         daqVals, daqValsTmp = [], []
 
-    # read bath temps
+    # read bath temps (both baths are polled at the same time)
     T_up, T_low, trgt_up, trgt_low, Text_up, Text_low = -999, -999, -999, -999, -999, -999
 
+    bathFields = ["bathTemp", "setpoint", "extTemp"]
+    requests   = []
     if up:
-        print('{} Reading upper bath'.format(status).ljust(80)),
-        T_up = bathUpper.getBathTemp()
-        trgt_up = bathUpper.getSetpoint()
-        Text_up = bathUpper.getExtTemp()
-
+        requests.append(bathUpper.queryManyAsync(bathFields))
     if low:
-        print('{} Reading lower bath'.format(status).ljust(80)),
-        T_low = bathLower.getBathTemp()
-        trgt_low = bathLower.getSetpoint()
-        Text_low = bathLower.getExtTemp()
+        requests.append(bathLower.queryManyAsync(bathFields))
+
+    if requests:
+        print('{} Reading baths'.format(status).ljust(80)),
+        results = runAll(requests)
+        if up:
+            state = results.pop(0)
+            T_up, trgt_up, Text_up = [-999 if getattr(state, f) is None else getattr(state, f) for f in bathFields]
+        if low:
+            state = results.pop(0)
+            T_low, trgt_low, Text_low = [-999 if getattr(state, f) is None else getattr(state, f) for f in bathFields]
 
     # write data (resistances)
     print('{} Writing data to file'.format(status).ljust(80)),
-    with open("{}_res.csv".format(filename), "a") as output:
-        output.write("{},{},{},{},{},{},{},{}\n".format(currentTime, T_up, Text_up, trgt_up, T_low, Text_low, trgt_low, daqVals))
+    bathVals = [T_up, Text_up, trgt_up, T_low, Text_low, trgt_low]
+    resLog.write(currentTime, bathVals + list(daqVals))
 
      # write data (temperatures + uncertainties)
-    with open("{}_tmp.csv".format(filename), "a") as output:
-        output.write("{},{},{},{},{},{},{},{}\n".format(currentTime, T_up, Text_up, trgt_up, T_low, Text_low, trgt_low, daqValsTmp))
+    tmpLog.write(currentTime, bathVals + list(daqValsTmp))
 
     # wait until next measurement instant
     next_read = datetime.datetime.fromtimestamp((t0 + readDelay)).strftime("%A, %B %d, %H:%M:%S")
     print('{} Waiting {} seconds for next read cycle at {}'.format(status, readDelay, next_read).ljust(80)),
     time.sleep(readDelay - (time.time() - t0))
 
+# report serial response times
+for bath in connected:
+    if hasattr(bath, "stats"):
+        print("\nResponse times (s), {}:".format(bath.conn.port))
+        print(bath.stats.report())
+
 # disconnect connected devices
 map(lambda x: x.disconnect(), connected)
+resLog.close()
+tmpLog.close()
 
 if args.email:
     cfg  = configparser.ConfigParser()
@@ -256,4 +272,8 @@ if args.email:
     fromEmail = cfg["Email"]["address"]
     fromPass  = cfg["Email"]["password"]
     e = Emailer(fromEmail, fromPass)
-    e.send(args.email, args.subject, ["{}_{}.csv".format(filename, mode) for mode in ["res", "tmp"]])
+    if args.format == "binary":
+        attachments = [exportCsv(log.filename) for log in [resLog, tmpLog]]
+    else:
+        attachments = [log.filename for log in [resLog, tmpLog]]
+    e.send(args.email, args.subject, attachments)
@@ -1,4 +1,6 @@
 ### Tools to facilitate column experiments
+import hashlib
+import json
 import os
 import shutil
 import re
@@ -7,7 +9,9 @@ import numpy as np
 import uncertainties as unc
 from uncertainties.umath import log as ulog
 
-from pandas import read_csv, DataFrame, melt
+from pandas import read_csv, DataFrame, Index, melt
+
+from DataLog import readLog, iterLog, writeFrame, logSize, checkPosition
 
 
 class Thermistor(object):
@@ -15,8 +19,18 @@ class Thermistor(object):
     Provides tools to deal with thermistors based on external calibration
     and name files
     """
+    COEFFICIENTS = ['a', 'b', 'c', 'd', 'uncert_a', 'uncert_b', 'uncert_c', 'uncert_d', 'R0']
+    RES_UNCERTAINTY = 0.12   # uncertainty (ohms) of resistance measurements and R0
+
+    # Lookup tables map log(R/R0) to temperature on an evenly spaced grid
+    TABLE_RANGE = (-3.0, 3.0)   # range of log(R/R0) covered (roughly -50 to 80 C)
+    TABLE_ERROR = 1e-5          # maximum interpolation error (K)
+
     def __init__(self):
         self.calibration = None
+        self.calibrationFile = None
+        self.coefficients = {}
+        self.tables = None
 
     def readNames(self, file):
         """
@@ -45,8 +59,30 @@ class Thermistor(object):
         calib = read_csv(file)
         calib = calib.set_index(calib.columns[1])
         self.calibration = calib.transpose().to_dict()
+        self.calibrationFile = file
+        self.coefficients = {}
+        self.tables = None
         return True
 
+    def getCoefficients(self, thermistors):
+        """
+        Returns calibration parameters for a list of thermistors (names) as a
+        dictionary of arrays, ordered the same way as the list. Arrays are only
+        built once for each distinct list of thermistors
+        """
+        thermistors = tuple(thermistors)
+        if thermistors not in self.coefficients:
+            missing = [x for x in thermistors if x not in self.calibration]
+            if missing:
+                raise LookupError('thermistors not in calibration file: {}'.format(", ".join(map(str, missing))))
+
+            C = {}
+            for key in self.COEFFICIENTS:
+                C[key] = np.array([self.calibration[x][key] for x in thermistors], dtype=float)
+            self.coefficients[thermistors] = C
+
+        return self.coefficients[thermistors]
+
     def calculateTemperature(self, res, thermistor):
         """
         Calculates temperature for a particular thermistor provided that a
@@ -61,6 +97,155 @@ class Thermistor(object):
         else:
             raise LookupError('thermistor not in calibration file')
 
+    def calculateTemperatures(self, res, thermistors):
+        """
+        Calculates temperatures (K) for a set of thermistors in a single call.
+        res can be a list of resistances (one per thermistor) or a 2-d array with
+        one row per sample and one column per thermistor
+        """
+        C = self.getCoefficients(thermistors)
+        res = np.asarray(res, dtype=float)
+        x = np.log(res / C['R0'])
+        T = 1 / (C['a'] + x * (C['b'] + x * (C['c'] + x * C['d'])))
+        return T
+
+    def buildTables(self, thermistors=None, cacheDir=None, maxError=TABLE_ERROR):
+        """
+        Precomputes a temperature lookup table for each of a list of thermistors (names,
+        default all thermistors in the calibration file).  The grid spacing is chosen so
+        that linear interpolation stays within maxError (K) of func, using an upper bound
+        of the second derivative of the calibration equation over the table range.
+        Thermistors whose calibration equation has a pole in the table range are skipped
+        with a warning, and are calculated exactly by lookupTemperatures.  Tables are
+        cached in cacheDir (defaults to the directory of the calibration file) under a
+        hash of the calibration file and the thermistors, so they are only rebuilt when
+        the calibration changes.  If the cache cannot be written the tables are only
+        kept in memory
+        """
+        if cacheDir is None:
+            cacheDir = path.dirname(path.abspath(self.calibrationFile))
+        names = sorted(self.calibration) if thermistors is None else sorted(set(thermistors))
+
+        with open(self.calibrationFile, "rb") as f:
+            key = hashlib.sha1(f.read())
+        key.update("{}{} bounded {}".format(self.TABLE_RANGE, maxError, ",".join(map(str, names))).encode())
+        cacheFile = path.join(cacheDir, "thermistorTables_{}.npz".format(key.hexdigest()[:16]))
+
+        # cached column indices refer to the old tables
+        for C in self.coefficients.values():
+            C.pop('column', None)
+
+        if path.exists(cacheFile):
+            cache = np.load(cacheFile)
+            self.tables = {key: cache[key] for key in cache.files}
+            self.tables['names']   = list(self.tables['names'])
+            self.tables['skipped'] = list(self.tables['skipped'])
+        else:
+            self.tables = self._makeTables(names, maxError)
+            try:
+                np.savez(cacheFile, **self.tables)
+            except (IOError, OSError) as e:
+                print("[WARNING] lookup tables not cached: {}".format(e))
+
+        if self.tables['skipped']:
+            print("[WARNING] no lookup tables for {} (pole in the table range), "
+                  "calculating them exactly".format(", ".join(map(str, self.tables['skipped']))))
+        return self.tables
+
+    def _makeTables(self, names, maxError):
+        """ lookup tables for a list of thermistors, see buildTables """
+        x0, x1 = self.TABLE_RANGE
+        M = self._boundSecondDerivative(self.getCoefficients(names), x0, x1)
+
+        skipped = [x for x, m in zip(names, M) if not np.isfinite(m)]
+        names   = [x for x, m in zip(names, M) if np.isfinite(m)]
+        C = self.getCoefficients(names)
+        M = np.max(M[np.isfinite(M)]) if names else 0.0
+
+        # linear interpolation error is at most h^2 * M / 8
+        n = int(np.ceil((x1 - x0) / np.sqrt(8 * maxError / M))) + 1 if M > 0 else 2
+        h = (x1 - x0) / (n - 1)
+
+        x = np.linspace(x0, x1, n)[:, np.newaxis]
+        T = 1 / (C['a'] + x * (C['b'] + x * (C['c'] + x * C['d'])))
+
+        return {'names': names, 'skipped': skipped, 'T': T, 'x0': x0, 'h': h, 'error': h ** 2 * M / 8}
+
+    @staticmethod
+    def _boundSecondDerivative(C, x0, x1, intervals=20000):
+        """
+        Upper bound of |T''| over [x0, x1] for each thermistor (inf if S has a root, i.e. T
+        a pole, in the range), using T = 1/S with S cubic in x:
+            |T''| = |2 S'^2 / S^3 - S'' / S^2| <= 2 max|S'|^2 / min|S|^3 + max|S''| / min|S|^2
+        The range of S, S' and S'' over each of many small intervals is exact: polynomials
+        take their extremes at the ends of an interval or at stationary points inside it
+        """
+        edges = np.linspace(x0, x1, intervals + 1)[:, np.newaxis]
+        xa, xb = edges[:-1], edges[1:]
+
+        def polyRange(coefs, stationary):
+            # evaluate at both ends and at the stationary points moved into the interval
+            # (moved points are still inside, so they cannot widen the range)
+            values = []
+            for x in [xa, xb] + [np.clip(np.where(np.isfinite(r), r, xa), xa, xb) for r in stationary]:
+                values.append(sum(c * x ** i for i, c in enumerate(coefs)))
+            return np.min(values, axis=0), np.max(values, axis=0)
+
+        a, b, c, d = C['a'], C['b'], C['c'], C['d']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            disc  = np.sqrt(4 * c ** 2 - 12 * b * d)        # roots of S' (nan if none)
+            rootsS  = [(-2 * c + disc) / (6 * d), (-2 * c - disc) / (6 * d), -b / (2 * c)]
+            rootsdS = [-c / (3 * d)]
+
+        Slo, Shi     = polyRange([a, b, c, d], rootsS)
+        dSlo, dShi   = polyRange([b, 2 * c, 3 * d], rootsdS)
+        d2Slo, d2Shi = polyRange([2 * c, 6 * d], [])
+
+        minS  = np.minimum(np.abs(Slo), np.abs(Shi))
+        maxdS = np.maximum(np.abs(dSlo), np.abs(dShi))
+        maxd2S = np.maximum(np.abs(d2Slo), np.abs(d2Shi))
+        with np.errstate(divide='ignore'):
+            bound = 2 * maxdS ** 2 / minS ** 3 + maxd2S / minS ** 2
+        bound[(Slo <= 0) & (Shi >= 0)] = np.inf
+        return np.max(bound, axis=0)
+
+    def lookupTemperatures(self, res, thermistors):
+        """
+        Same as calculateTemperatures, but interpolates temperatures from the tables
+        made by buildTables (built for these thermistors if there are none yet).
+        Resistances outside of the tables, and thermistors without a table, are
+        calculated exactly
+        """
+        if self.tables is None:
+            self.buildTables(thermistors)
+
+        C = self.getCoefficients(thermistors)
+        if 'column' not in C:
+            names = self.tables['names']
+            C['column'] = np.array([names.index(x) if x in names else -1 for x in thermistors])
+
+        if not self.tables['names']:
+            return self.calculateTemperatures(res, thermistors)
+
+        tables = self.tables['T']
+        res = np.asarray(res, dtype=float)
+        x = np.log(res / C['R0'])
+
+        pos = (x - self.tables['x0']) / self.tables['h']
+        idx = np.floor(pos)
+        col = np.broadcast_to(C['column'], idx.shape)
+        inRange = (idx >= 0) & (idx < tables.shape[0] - 1) & (col >= 0)
+        idx = np.clip(idx, 0, tables.shape[0] - 2).astype(int)
+        col = np.maximum(col, 0)
+
+        T0 = tables[idx, col]
+        T = T0 + (pos - idx) * (tables[idx + 1, col] - T0)
+
+        if not np.all(inRange):
+            T = np.where(inRange, T, self.calculateTemperatures(res, thermistors))
+
+        return T
+
     def calculateUncertainty(self, res, thermistor):
         """
         calculates uncertainty on thermistor given a resistance and the thermistor name
@@ -72,8 +257,8 @@ class Thermistor(object):
             (a,b,c,d, uncert_a, uncert_b, uncert_c, uncert_d,R0) = [C[x] for x in keys]
 
             # add uncertainty to resistance measurements
-            R0 = unc.ufloat(R0, 0.12)
-            res = unc.ufloat(res, 0.12)
+            R0 = unc.ufloat(R0, self.RES_UNCERTAINTY)
+            res = unc.ufloat(res, self.RES_UNCERTAINTY)
 
             Tu = self.func(res, unc.ufloat(a, uncert_a*2), unc.ufloat(b, uncert_b*2),
                          unc.ufloat(c, uncert_c*2), unc.ufloat(d, uncert_d*2), R0)
@@ -81,6 +266,40 @@ class Thermistor(object):
         else:
             raise LookupError('thermistor not in calibration file')
 
+    def calculateUncertainties(self, res, thermistors, reference=False):
+        """
+        Calculates uncertainties (K) for a set of thermistors in a single call using
+        first-order propagation of the calibration and resistance uncertainties.
+        res has the same layout as in calculateTemperatures.  If reference is True,
+        each value is calculated with calculateUncertainty (ufloat) instead
+        """
+        res = np.asarray(res, dtype=float)
+        if reference:
+            thermistors = list(thermistors)
+            U = np.empty(res.shape)
+            for idx in np.ndindex(res.shape):
+                U[idx] = self.calculateUncertainty(res[idx], thermistors[idx[-1]])
+            return U
+
+        C = self.getCoefficients(thermistors)
+        x = np.log(res / C['R0'])
+        T = 1 / (C['a'] + x * (C['b'] + x * (C['c'] + x * C['d'])))
+
+        # partial derivatives of T with respect to a, b, c, d and log(R/R0)
+        T2 = T ** 2
+        dTdx = -T2 * (C['b'] + x * (2 * C['c'] + x * 3 * C['d']))
+
+        # R and R0 are independent, so their contributions to log(R/R0) add in quadrature
+        var_x = (self.RES_UNCERTAINTY / res) ** 2 + (self.RES_UNCERTAINTY / C['R0']) ** 2
+
+        var = T2 ** 2 * ((2 * C['uncert_a']) ** 2 +
+                         (2 * C['uncert_b'] * x) ** 2 +
+                         (2 * C['uncert_c'] * x ** 2) ** 2 +
+                         (2 * C['uncert_d'] * x ** 3) ** 2)
+        var += dTdx ** 2 * var_x
+
+        return np.sqrt(var)
+
     @staticmethod
     def func(R, a, b, c, d, R0):
         """
@@ -142,6 +361,50 @@ def getChannelName(channel):
     return "T17-S{}C{}-{}".format(str(slot), str(cable), str(k).zfill(3))
 
 
+class ThermistorGeometry(object):
+    """
+    Position of each thermistor in the soil column, from thermistorPosition.csv. Positions
+    (3 digits: column, then row) are parsed once into arrays of column, row and height (cm,
+    from row_heights), so the geometry of many thermistors is looked up at once:
+        geometry.depth(["T1", "T2"], soil_height)   # array of depths in mm
+    Names may be a single name or a sequence of names
+    """
+
+    def __init__(self, position, row_heights):
+        names = sorted(position)
+        self.index  = Index(names)
+        self.column = np.array([int(str(position[x])[0]) for x in names])
+        self.row    = np.array([int(str(position[x])[1:3]) for x in names])
+        self.height = np.array([row_heights[x] for x in self.row])
+
+    def locate(self, names):
+        """ index of each thermistor in the arrays """
+        i = self.index.get_indexer(np.atleast_1d(names))
+        if (i < 0).any():
+            raise KeyError(", ".join(map(str, np.atleast_1d(names)[i < 0])))
+        return i if np.ndim(names) else i[0]
+
+    def getColumn(self, names):
+        return self.column[self.locate(names)]
+
+    def getRow(self, names):
+        return self.row[self.locate(names)]
+
+    def getHeight(self, names):
+        """ height (cm) above the reference of ColumnExperiment.ROW_HEIGHTS """
+        return self.height[self.locate(names)]
+
+    def getDepth(self, names, soil_height):
+        """ depth (mm) below the soil surface, soil_height in cm """
+        return (soil_height - self.getHeight(names)) * 10
+
+    def frame(self):
+        """ DataFrame with the name, column, row and height of each thermistor """
+        return DataFrame({'name': self.index.values, 'column': self.column,
+                          'row': self.row, 'height': self.height},
+                         columns=['name', 'column', 'row', 'height'])
+
+
 class ColumnExperiment(object):
     # 275mm from top of ring to midpoint of lowest thermistor.
     # 230mm from top of ring to top of lower brass plate
@@ -149,50 +412,73 @@ class ColumnExperiment(object):
 
     ROW_HEIGHTS = dict(zip(range(1, 24), np.arange(44. + 2.75, -2. + 2.75, -2)))
 
-    def __init__(self, raw_data, cfg_dir, soil_height):
+    # progress of incremental processing, saved in the output directory
+    PROGRESS_FILE = "progress.json"
+
+    def __init__(self, raw_data, cfg_dir, soil_height, config = None):
         self.soil_height = soil_height # height of top of soil in column
         self.cfg_dir = cfg_dir
         self.raw_data = raw_data
-        self.experiment = re.sub("_[tr][me][ps]\\..*$", "", path.basename(self.raw_data))
-        self.output_dir = path.join(path.dirname(self.raw_data), self.experiment)
+        self.experiment = self.experimentName(raw_data)
+        self.output_dir = self.outputDir(raw_data)
         self.overwrite  = False
+        self.incremental = False
+        self.block_rows  = None
 
         # Define height of each row index
-        self._read_config_dir(cfg_dir)
+        self._read_config_dir(cfg_dir, config)
+
+    @staticmethod
+    def experimentName(raw_data):
+        ''' name of the experiment of a raw data file, e.g. 'column1' for 'column1_tmp.csv' '''
+        return(re.sub("_[tr][me][ps]\\..*$", "", path.basename(raw_data.rstrip("/\\"))))
+
+    @classmethod
+    def outputDir(cls, raw_data):
+        ''' directory the results of a raw data file are saved in '''
+        return(path.join(path.dirname(raw_data.rstrip("/\\")), cls.experimentName(raw_data)))
 
-    def _read_config_dir(self, cfg_dir):
+    def _read_config_dir(self, cfg_dir, config = None):
+        """
+        Uses the configuration of cfg_dir, read by readConfig unless it is given as config
+        (which saves reading it again for each of many experiments)
+        """
+        if config is None:
+            config = self.readConfig(cfg_dir)
+        self.names    = config["names"]
+        self.position = config["position"]
+        self.geometry = config["geometry"]
+
+    @classmethod
+    def readConfig(cls, cfg_dir):
         """
         Looks for the following configuration files and reads them into dictionaries:
         thermistorNames.csv
         thermistorPosition.csv
+        Returns a dictionary of these ("names" and "position"), and the ThermistorGeometry
+        built from the positions ("geometry")
         """
         f = listdir(cfg_dir)
 
         # find calibration files in configuration directory
-        f_names    = self.__find_in_list(f, "thermistorNames")
-        f_position = self.__find_in_list(f, "thermistorPosition")
+        f_names    = cls.__find_in_list(f, "thermistorNames")
+        f_position = cls.__find_in_list(f, "thermistorPosition")
 
         # create dictionaries from csv's
         names_data = read_csv(path.join(cfg_dir, f_names[0]))
-        self.names = dict(zip(names_data.ix[:, 0], names_data.ix[:, 1]))
         pos_data = read_csv(path.join(cfg_dir, f_position[0]))
-        self.position = dict(zip(pos_data.ix[:, 1], pos_data.ix[:, 0])) # 'reversed' column index order
+        position = dict(zip(pos_data.ix[:, 1], pos_data.ix[:, 0])) # 'reversed' column index order
+        return {"names":    dict(zip(names_data.ix[:, 0], names_data.ix[:, 1])),
+                "position": position,
+                "geometry": ThermistorGeometry(position, cls.ROW_HEIGHTS)}
 
     def getThermistorDepth(self, thermistor_name):
-        ''' get thermistor depth relative to soil surface'''
-        therm_pos    = self.position[thermistor_name]
-        therm_row    = int(str(therm_pos)[1:3])
-        therm_height = self.ROW_HEIGHTS[therm_row]
-        therm_depth  = self.soil_height - therm_height
-
-        return(therm_depth)
+        ''' get thermistor depth (cm) relative to soil surface, for one name or a list of names'''
+        return(self.soil_height - self.geometry.getHeight(thermistor_name))
 
     def getThermistorColumn(self, thermistor_name):
-        ''' get column index of thermistor in tube'''
-        therm_pos    = self.position[thermistor_name]
-        therm_col    = int(str(therm_pos)[0])
-
-        return(therm_col)
+        ''' get column index of thermistor in tube, for one name or a list of names'''
+        return(self.geometry.getColumn(thermistor_name))
 
     @staticmethod
     def __find_in_list(lst, pattern):
@@ -206,14 +492,52 @@ class ColumnExperiment(object):
             if self.overwrite:
                 shutil.rmtree(self.output_dir)
             else:
-                print("output directory already exists!  Exiting")
-                exit(1)
+                raise OSError("output directory {} already exists".format(self.output_dir))
         os.makedirs(self.output_dir)
 
 
     def setOverwrite(self, permission):
         self.overwrite = permission
 
+    def setIncremental(self, incremental):
+        """
+        In incremental mode, an existing output directory is kept and only the readings
+        added to the raw data since the last run are processed and appended to the
+        (csv) processed file. The position reached is saved in PROGRESS_FILE
+        """
+        self.incremental = incremental
+
+    def setBlockSize(self, rows):
+        """
+        Process the raw data rows readings at a time (None for all at once), to limit
+        memory use for long experiments. The processed file is then always csv
+        """
+        self.block_rows = rows
+
+    def _read_progress(self):
+        progress_file = path.join(self.output_dir, self.PROGRESS_FILE)
+        if not path.exists(progress_file):
+            return None
+        with open(progress_file) as f:
+            return json.load(f)
+
+    def _check_progress(self, progress):
+        """
+        Check that the raw data still holds the readings processed by the last run: it has
+        not shrunk, and the reading before the saved position has the saved time. Raises
+        ValueError if not, e.g. because the log was restarted or replaced
+        """
+        if progress["position"] == 0:
+            return
+        timestamp = checkPosition(self.raw_data, progress["position"])
+        if logSize(self.raw_data) < progress.get("raw_size", 0) or str(timestamp) != progress["timestamp"]:
+            raise ValueError("{} does not match the readings processed until {}, it may have been "
+                             "replaced (use -f to process it again)".format(self.raw_data, progress["timestamp"]))
+
+    def _write_progress(self, progress):
+        with open(path.join(self.output_dir, self.PROGRESS_FILE), "w") as f:
+            json.dump(progress, f, indent=2, sort_keys=True)
+
     def __copy_config(self):
         dest = path.join(self.output_dir, "cfg")
         shutil.copytree(self.cfg_dir, dest)
@@ -221,52 +545,134 @@ class ColumnExperiment(object):
     def __copy_rawdata(self):
         # copy raw resistance data
         res = re.sub("tmp", "res", self.raw_data)
-        shutil.copyfile(res, path.join(self.output_dir, path.basename(res)))
+        self.__copy(res, path.join(self.output_dir, path.basename(res)))
 
         # copy raw temperature data
         tmp = self.raw_data
-        shutil.copyfile(tmp, path.join(self.output_dir, path.basename(tmp)))
+        self.__copy(tmp, path.join(self.output_dir, path.basename(tmp)))
+
+    @staticmethod
+    def __copy(src, dest):
+        # binary logs are directories
+        if path.isdir(src):
+            if path.exists(dest):
+                shutil.rmtree(dest)
+            shutil.copytree(src, dest)
+        else:
+            shutil.copyfile(src, dest)
 
     def __zip_output_dir(self):
         print('not implemented yet')
         pass
 
-    def _rename_column(self, column_name):
-        if (re.match("Time", column_name) or
-            re.match("upper", column_name) or
-            re.match("lower", column_name)):
-            return(column_name)
+    def _describe_columns(self, column_names):
+        """
+        Returns a dictionary of the (position, depth, column, meas_type, variable) fields that
+        processFile gives the rows of each column of the raw data. Thermistors are named by
+        position, "C<column>D<depth in mm>" (with "_stdev" for uncertainties), looking up the
+        geometry of all thermistors at once; other columns (Time, upper..., lower...) keep
+        their names
+        """
+        positions = {}
+        therms = []
+        for x in column_names:
+            if re.match("Time|upper|lower", x):
+                positions[x] = x
+            else:
+                therms.append(x)
+
+        bases = [re.sub("_stdev$", "", x) for x in therms]
+        D = self.geometry.getDepth(bases, self.soil_height)
+        C = self.geometry.getColumn(bases)
+        for x, base, d, c in zip(therms, bases, D, C):
+            positions[x] = "C{:.0f}D{:.0f}".format(c, d) + ("_stdev" if x != base else "")
+
+        fields = {}
+        for x, position in positions.items():
+            if re.match("C.*D.*", position):
+                depth  = re.sub("C\dD([^\_]*)[^0-9]*", "\\1", position)
+                column = re.sub("C(\d).*", "\\1", position)
+            else:
+                depth  = -999
+                column = -999
+            meas_type = "uncertainty" if re.match(".*stdev", position) else "measurement"
+            fields[x] = (re.sub('_stdev', "", position), depth, column, meas_type, re.sub('_stdev', "", x))
+
+        return(fields)
 
-        stdev = None
-        if (re.match(".*_stdev$", column_name)):
-            column_name = re.sub("_stdev$", "", column_name)
-            stdev = 1
 
-        D = self.getThermistorDepth(column_name) * 10 # convert to mm
-        C = self.getThermistorColumn(column_name)
+    def processFile(self, output_file = None, append = False, block_rows = None):
+        """
+        Process the raw data and save it to output_file (by default in the output directory).
+        If append is True, only the readings added since the last call are processed, and
+        are appended to output_file. If block_rows is given, the raw data is read and
+        processed block_rows readings at a time, and each block is written before the next
+        is read, so memory use does not depend on the length of the experiment; the output
+        is the same as processing all readings at once. Both require a csv output_file
+        """
+        if output_file is None:
+            output_file = re.sub("[tr][em][ps]\\.", "processed.", path.basename(self.raw_data))
+            if append or block_rows:
+                output_file = re.sub("\\.npl$", ".csv", output_file)
+            output_file = path.join(self.output_dir, output_file)
 
-        newname = "C{:.0f}D{:.0f}".format(C, D)
-        if stdev:
-            newname = newname + "_stdev"
-        return(newname)
+        if (append or block_rows) and output_file.endswith(".npl"):
+            raise ValueError("incremental and block processing can only write csv files")
+
+        # continue after the readings processed by the last run. The output is truncated to
+        # its size at that time, in case the last run stopped before saving its progress
+        progress = self._read_progress() if append else None
+        if (progress is None or progress["output"] != path.basename(output_file) or
+            not path.exists(output_file)):
+            progress = {"output": path.basename(output_file), "position": 0, "size": 0, "timestamp": None,
+                        "raw_size": 0}
+        self._check_progress(progress)
+        if progress["size"] > 0:
+            with open(output_file, "r+b") as f:
+                f.truncate(progress["size"])
+
+        # read data (csv or binary log)
+        if append or block_rows:
+            blocks = iterLog(self.raw_data, block_rows, progress["position"])
+        else:
+            blocks = [(readLog(self.raw_data), None)]
+
+        # readings of one time are always in the same block, so the processed blocks
+        # follow each other in the same order as when processed all at once
+        header = progress["size"] == 0
+        nBlocks = 0
+        for raw, position in blocks:
+            nBlocks += 1
+            df = self._process_frame(raw)
+
+            # save file
+            if output_file.endswith(".npl"):
+                writeFrame(df, output_file)
+            else:
+                df.to_csv(output_file, index=False, header=header, mode="w" if header else "a")
+            header = False
 
+            if append:
+                progress["position"]  = position
+                progress["size"]      = path.getsize(output_file)
+                progress["timestamp"] = str(raw['Timestamp'].iloc[-1])
+                progress["raw_size"]  = logSize(self.raw_data)
+                self._write_progress(progress)
 
-    def processFile(self, output_file = None):
-        # read data
-        df = read_csv(self.raw_data)
+        if append and nBlocks == 0:
+            print("no new readings since {}".format(progress["timestamp"]))
 
+    def _process_frame(self, df):
+        """ reshape raw data into the long format written by processFile """
         # reshape data
         df = melt(df, id_vars=['Timestamp'])
 
-        # create new columns
-        df['position'] = [self._rename_column(x) for x in df['variable']]
-        df['depth'] = [re.sub("C\dD([^\_]*)[^0-9]*", "\\1", x) if re.match("C.*D.*", x) else -999 for x in df['position']]
-        df['column'] = [re.sub("C(\d).*", "\\1", x) if re.match("C.*D.*", x) else -999 for x in df['position']]
-        df['meas_type'] = ["uncertainty" if re.match(".*stdev", x) else "measurement" for x in df['position']]
-
-        # homogenize position and variable columns in preparation for unstacking
-        df['position'] = [re.sub('_stdev', "", x) for x in df['position']]
-        df['variable'] = [re.sub('_stdev', "", x) for x in df['variable']]
+        # create new columns. Each distinct column name of the raw data is only parsed once,
+        # and the results are looked up for every row. position and variable are homogenized
+        # (without '_stdev') in preparation for unstacking
+        fields = self._describe_columns(df['variable'].unique())
+        for i, key in enumerate(['position', 'depth', 'column', 'meas_type', 'variable']):
+            df[key] = df['variable'].map(dict((x, fields[x][i]) for x in fields))
 
         # reshape (unstack) data
         df = df.set_index(['Timestamp','position', 'variable', 'depth', 'column', 'meas_type'])
@@ -280,20 +686,22 @@ class ColumnExperiment(object):
         df.loc[df['name'] == 'upperExtTemp', 'depth'] = 0
         df.loc[df['name'] == 'lowerExtTemp', 'depth'] = self.soil_height * 10 - 23
 
-        # save file
-        if output_file is None:
-            output_file = re.sub("[tr][em][ps]\\.", "processed.", path.basename(self.raw_data))
-            output_file = path.join(self.output_dir, output_file)
-
-        df.to_csv(output_file, index=False)
+        return(df)
 
     def processColumn(self, copycfg = True, copyraw = True, zip = False):
+        if self.incremental and not self.overwrite and path.exists(self.output_dir):
+            # keep the results of earlier runs, and refresh the copy of the raw data
+            self.processFile(append = True, block_rows = self.block_rows)
+            if copyraw:
+                self.__copy_rawdata()
+            return(True)
+
         self.__create_output_dir()
         if copyraw:
             self.__copy_rawdata()
         if copycfg:
             self.__copy_config()
-        self.processFile()
+        self.processFile(append = self.incremental, block_rows = self.block_rows)
 
         if zip:
             self.__zip_output_dir()
@@ -1,88 +1,17 @@
 import datetime
-import math
 import smtplib
 import sys
 import time
 
+from multiprocessing      import TimeoutError
+from multiprocessing.pool import ThreadPool
+
 from Keysight34972A import Keysight34972A
 from Fluke7341  import Fluke7341
 from Fluke1502A import Fluke1502A
-
-class RingBuffer():
-
-    def __init__(self, size):
-        self.size    = size
-        self.buffer  = [0] * size
-        self.pointer = 0
-        self.count   = 0
-
-    def update(self, value):
-        self.buffer[self.pointer] = value
-        self.pointer = (self.pointer + 1) % self.size
-        self.count  += 1
-
-    def reset(self):
-        self.count   = 0
-
-    def getAverage(self, silent=True):
-        if self.count < self.size:
-            if not silent:
-                print "[WARNING] Buffer has not been filled completely: [{}/{}]".format(self.count, self.size)
-        return sum(self.buffer) / self.size
-
-    def getSTD(self):
-        std = 0
-        avg = self.getAverage()
-        for i in range(self.size):
-            std += (self.buffer[i] - avg) ** 2
-        std /= self.size
-        return math.sqrt(std)
-
-class EquilibriumMonitor():
-
-    def __init__(self, size, name=""):
-
-        self.size     = size
-        self.readings = RingBuffer(size)
-        self.STDs     = [99.0] * size
-        self.count    = 0
-        self.name     = name
-        self.nReadings = 0
-
-    def update(self, value):
-        self.readings.update(value)
-        std = self.readings.getSTD()
-        self.nReadings += 1
-
-        if self.nReadings >= self.size:
-            self.count += 1
-            if std < min(self.STDs):
-                self._print("converging")
-                self.minSTD = std
-                self.count  = 0
-
-            elif std > max(self.STDs) * 1.025:
-                self._print("diverging")
-                self.count  = 0
-
-            elif self.count < self.size:
-                self._print("stabilizing")
-        else:
-            self._print("need more readings")
-
-        self.STDs = self.STDs[1:] + [std]
-
-    def isEqualized(self):
-        return self.count >= self.size
-
-    def reset(self):
-        self.count = 0
-
-    def _print(self, msg):
-        val = self.count
-        if self.nReadings < self.size:
-            val = self.nReadings
-        print "{} {} [{}/{}]".format(self.name.rjust(8), msg, val, self.size)
+from DataLog    import CsvLogWriter
+from Equilibrium import EquilibriumMonitor, EquilibriumArray
+from SetpointScheduler import SetpointScheduler
 
 class Controller():
 
@@ -103,24 +32,39 @@ class Controller():
 
     STATES = ["RAMP", "HOLD", "WAIT", "SET", "STOP", "GO", "LOGGERON", "LOGGEROFF"]
 
+    # max. time (s) to wait for each instrument to return a reading
+    READ_TIMEOUTS = {"bath": 10.0, "probe": 5.0, "daq": 30.0}
+
     def __init__(self):
 
         self.sampleInterval = 5
         self.bufferSize     = 30
         self.stdHoldCount   = 30
         self.doLogging      = True
+        self.useScheduler   = False     # overshoot the bath setpoint at each RAMP step (see SetpointScheduler)
 
         self.daq   = None
         self.bath  = None
         self.probe = None
+        self.pool    = None             # threads used to read instruments concurrently
+        self.pending = {}               # readings in progress, by instrument
 
         self.sensorList    = []
-        self.sensorBuffers = []
+        self.sensorBuffers = None       # EquilibriumArray for all sensors
         self.probeBuffer   = None
         self.bathBuffer    = None
         self.numSensors    = 0
 
+        # optional equilibrium criterion for the probe readings (e.g. DriftCriterion) used instead
+        # of the standard deviation test of probeBuffer to decide equilibrium
+        self.criterion     = None
+        self.dwellStart    = 0          # time the current wait for equilibrium started
+        self.dwellLog      = []         # (setpoint, time to equilibrium, min. time saved) of each wait
+        self.scheduler     = None       # SetpointScheduler if useScheduler
+        self.probeTemp     = float("nan")   # last probe reading
+
         self.file      = ""
+        self.log       = None
         self.commands  = []             # command queue
         self.command   = 0              # index of current command within self.commands
         self.state     = self.GO
@@ -154,8 +98,10 @@ class Controller():
             print "Failed to connect to Fluke1502A (Probe Reader)"
             return False
 
+        self.pool  = ThreadPool(len(self.READ_TIMEOUTS))
         self.epoch = time.time()
         self.t0    = time.time()
+        self.dwellStart = self.epoch
 
         return True
 
@@ -164,20 +110,25 @@ class Controller():
             self.daq.disconnect()
         self.bath.disconnect()
         self.probe.disconnect()
+        if self.log:
+            self.log.close()
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
 
     def init(self):
 
         self.numSensors    =  len(self.sensorList)
-        self.sensorBuffers = [EquilibriumMonitor(self.bufferSize, name="sensor{}".format(i)) for i in range(self.numSensors)]
+        self.sensorBuffers =  EquilibriumArray(self.bufferSize, self.numSensors, name="sensors")
         self.probeBuffer   =  EquilibriumMonitor(self.bufferSize, name="probe")
         self.bathBuffer    =  EquilibriumMonitor(self.bufferSize, name="bath")
+        self.scheduler     =  SetpointScheduler(self.TEMP_MIN, self.TEMP_MAX) if self.useScheduler else None
 
         timestamp = datetime.datetime.now().isoformat().split('.')[0].replace(':', '-')
         self.file = "{}.csv".format(timestamp)
-        f = open(self.file, "a")
-        f.write("Timestamp,Elapsed Time,Setpoint,Bath Temp,Probe Temp,{}\n".format(
-            ",".join(["r{}".format(i) for i in range(self.numSensors)])))
-        f.close()
+        headers = ["Timestamp", "Elapsed Time", "Setpoint", "Bath Temp", "Probe Temp"]
+        headers += ["r{}".format(i) for i in range(self.numSensors)]
+        self.log = CsvLogWriter(self.file, headers, timeFormat=self.formatTime)
 
     def validateCommand(self, command):
 
@@ -326,7 +277,7 @@ class Controller():
             self.setpoint = args[0]
             self.rampEnd  = args[1]
             self.rampInc  = args[2]
-            self.bath.setSetpoint(self.setpoint)
+            self.setRampSetpoint()
             self.state = self.RAMP
         elif action == "set":
             self.setpoint = args[0]
@@ -347,14 +298,45 @@ class Controller():
         self.info("state: {}".format(self.STATES[self.state]))
 
 
+    def setRampSetpoint(self):
+        """ set the bath to the current RAMP setpoint, starting with an overshoot if scheduling """
+        bathSetpoint = self.setpoint
+        if self.scheduler is not None:
+            bathSetpoint = self.scheduler.start(self.setpoint, self.probeTemp, time.time())
+            bathSetpoint = min(max(bathSetpoint, self.TEMP_MIN), self.TEMP_MAX)
+            if bathSetpoint != self.setpoint:
+                self.info("overshoot: bath set to {:.3f} for {:.0f} s".format(
+                    bathSetpoint, self.scheduler.switchTime - time.time()))
+        self.bath.setSetpoint(bathSetpoint)
+
     def isEqualized(self):
+        if self.scheduler is not None and self.scheduler.isActive():
+            return False
+        if self.criterion is not None:
+            return self.criterion.isEqualized()
         return self.probeBuffer.isEqualized()
 
+    def recordDwell(self):
+        """
+        Records the time taken to reach equilibrium. With a criterion, also records the minimum
+        time the standard deviation test would still have needed, i.e. the time saved
+        """
+        dwell = time.time() - self.dwellStart
+        saved = 0
+        if self.criterion is not None:
+            saved = self.probeBuffer.remaining() * self.sampleInterval
+        self.dwellLog.append((self.setpoint, dwell, saved))
+        self.info("equilibrium at {} after {:.0f} s ({:.0f} s saved)".format(self.setpoint, dwell, saved))
+        if self.scheduler is not None and self.state == self.RAMP:
+            self.scheduler.finish(time.time())
+
     def resetBuffers(self):
         self.bathBuffer.reset()
         self.probeBuffer.reset()
-        for i in range(self.numSensors):
-            self.sensorBuffers[i].reset()
+        self.sensorBuffers.reset()
+        if self.criterion is not None:
+            self.criterion.reset()
+        self.dwellStart = time.time()
 
     def runProgram(self, program):
 
@@ -388,6 +370,7 @@ class Controller():
 
             elif self.state == self.WAIT:
                 if self.isEqualized():
+                    self.recordDwell()
                     self.nextState()
 
             elif self.state == self.SET:
@@ -395,13 +378,16 @@ class Controller():
                 self.nextState()
 
             elif self.state == self.RAMP:
-                if abs(self.setpoint - self.rampEnd) < 0.001:
-                    if self.isEqualized():
-                        self.nextState()
+                # the last setpoint is rampEnd: once it is equalized the next command starts,
+                # and the bath is not stepped beyond rampEnd
                 if self.isEqualized():
-                    self.setpoint += self.rampInc
-                    self.bath.setSetpoint(self.setpoint)
-                    self.resetBuffers()
+                    self.recordDwell()
+                    if abs(self.setpoint - self.rampEnd) < 0.001:
+                        self.nextState()
+                    else:
+                        self.setpoint += self.rampInc
+                        self.setRampSetpoint()
+                        self.resetBuffers()
 
             elif self.state == self.STOP:
                 pass
@@ -409,39 +395,83 @@ class Controller():
             else:
                 self.error("Unknown state: {}".format(self.state))
 
-        self.disconnect()
+        if self.dwellLog:
+            self.info("total time to equilibrium: {:.0f} s, saved: {:.0f} s".format(
+                sum([dwell for setpoint, dwell, saved in self.dwellLog]),
+                sum([saved for setpoint, dwell, saved in self.dwellLog])))
+        if self.scheduler is not None and self.scheduler.steps:
+            self.info("RAMP settling times:\n{}".format(self.scheduler.report()))
 
-    def step(self):
-        elapsedTime = datetime.datetime.now() - datetime.datetime.fromtimestamp(self.epoch)
-        # make new readings and update appropriate buffers
-        bathTemp    = float(self.bath.readTemp())
-        probeTemp   = float(self.probe.readTemp())
+        self.disconnect()
 
-        resistances = []
+    def readInstruments(self):
+        """
+        Reads all instruments at the same time, so a step takes as long as the slowest
+        instrument rather than the sum of all of them.  Returns a dict of readings by
+        instrument name.  Instruments that do not respond within their READ_TIMEOUTS
+        are left out, and are not read again until the late reading has returned
+        """
+        readers = {
+            "bath":  lambda: float(self.bath.readTemp()),
+            "probe": lambda: float(self.probe.readTemp()),
+        }
         if self.numSensors > 0:
-            resistances = self.daq.readValues()
+            readers["daq"] = self.daq.readValues
+
+        t0 = time.time()
+        started = []
+        for name, reader in readers.items():
+            if name in self.pending and not self.pending[name].ready():
+                self.warning("{} is still busy with previous reading".format(name))
+                continue
+            self.pending[name] = self.pool.apply_async(reader)
+            started.append(name)
+
+        readings = {}
+        for name in started:
+            timeout = max(0, t0 + self.READ_TIMEOUTS[name] - time.time())
+            try:
+                readings[name] = self.pending[name].get(timeout)
+                del self.pending[name]
+            except TimeoutError:
+                self.warning("{} did not respond within {} s".format(name, self.READ_TIMEOUTS[name]))
+
+        return readings
+
+    def step(self):
+        # all readings of a step share the time at which they were requested
+        sampleTime  = time.time()
+        elapsedTime = datetime.datetime.fromtimestamp(sampleTime) - datetime.datetime.fromtimestamp(self.epoch)
 
-        self.bathBuffer.update(bathTemp)
-        self.probeBuffer.update(probeTemp)
-        for i in range(self.numSensors):
-            self.sensorBuffers[i].update(resistances[i])
+        # make new readings and update appropriate buffers
+        readings    = self.readInstruments()
+        bathTemp    = readings.get("bath",  float("nan"))
+        probeTemp   = readings.get("probe", float("nan"))
+        resistances = readings.get("daq",   [float("nan")] * self.numSensors)
+
+        if "bath" in readings:
+            self.bathBuffer.update(bathTemp)
+        if "probe" in readings:
+            self.probeBuffer.update(probeTemp)
+            if self.criterion is not None:
+                self.criterion.update(probeTemp, sampleTime)
+            self.probeTemp = probeTemp
+            if self.scheduler is not None and self.state == self.RAMP:
+                bathSetpoint = self.scheduler.update(sampleTime, probeTemp)
+                if bathSetpoint is not None:
+                    self.info("overshoot done: bath set to {}".format(bathSetpoint))
+                    self.bath.setSetpoint(bathSetpoint)
+        if "daq" in readings:
+            self.sensorBuffers.update(resistances[:self.numSensors])
 
         # log results
         if self.doLogging:
-            t = datetime.datetime.now()
-            timestamp   = "{}/{}/{} {}:{}:{}".format(t.month, t.day, t.year, t.hour, t.minute, t.second)
-
             seconds =  elapsedTime.seconds %    60
             minutes = (elapsedTime.seconds /    60) % 60
             hours   = (elapsedTime.seconds /  3600) % 24
             elapsedTime   = "{}:{}:{}".format(hours, minutes, seconds)
 
-            output = open(self.file, "a")
-            resistances = ",".join([str(r) for r in resistances])
-            output.write(",".join([timestamp, elapsedTime, str(self.setpoint),
-                                    str(bathTemp), str(probeTemp), resistances]))
-            output.write("\n")
-            output.close()
+            self.log.write(sampleTime, [elapsedTime, self.setpoint, bathTemp, probeTemp] + list(resistances))
 
             # wait until next measurement interval
         while time.time() < self.t0 + self.sampleInterval:
@@ -449,6 +479,11 @@ class Controller():
 
         self.t0 = self.t0 + self.sampleInterval
 
+    @staticmethod
+    def formatTime(t):
+        t = datetime.datetime.fromtimestamp(t)
+        return "{}/{}/{} {}:{}:{}".format(t.month, t.day, t.year, t.hour, t.minute, t.second)
+
     def info(self, msg):
         if self.DEBUG: print "[INFO]", msg
 
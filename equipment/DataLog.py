@@ -0,0 +1,583 @@
+"""
+Writers and readers for logged instrument data
+
+Two formats are supported:
+    csv    - one text line per reading, the first column being an ISO timestamp
+    binary - a directory (conventionally named *.npl) holding float64 arrays:
+                 columns.json     column names, and labels of any text columns
+                 chunk_00000.npy  completed chunks, one row per column (columnar)
+                 tail_00001.bin   readings not yet in a chunk, stored row by row
+             The first column is the time of each reading in seconds since the epoch.
+
+Both writers share the same interface, so logging scripts only choose the format
+when opening the log:
+    log = openLog("experiment_res", ["Timestamp", "T1", "T2"], fmt="binary")
+    log.write(time.time(), [1.0, 2.0])
+    log.close()
+
+readLog returns a pandas DataFrame for either format, with the time column in the
+same ISO format as the csv files. readLogFrom returns only the readings after a given
+position, so a growing log can be processed incrementally, and iterLog reads a log in
+blocks of readings, so memory use does not depend on its length. exportCsv converts a
+binary log to csv on demand.
+"""
+import datetime
+import io
+import itertools
+import json
+import os
+import re
+import struct
+import time
+from os import path, listdir
+
+import numpy as np
+from pandas import DataFrame, read_csv, to_numeric
+
+FORMATS    = ["csv", "binary"]
+EXTENSIONS = {"csv": ".csv", "binary": ".npl"}
+
+CHUNK_SIZE = 1000                # readings per completed chunk
+META_FILE  = "columns.json"
+CHUNK_FILE = "chunk_{:05d}.npy"
+TAIL_FILE  = "tail_{:05d}.bin"
+JOURNAL_FILE = "journal.bin"
+
+FLUSH_ROWS          = 10        # readings kept in memory before writing to file
+FLUSH_INTERVAL      = 60        # max. time (s) readings are kept in memory
+CHECKPOINT_INTERVAL = 600       # time (s) between syncing the log to disk
+
+
+def isoTime(t):
+    """Convert seconds since the epoch to a (local time) ISO timestamp"""
+    return datetime.datetime.fromtimestamp(t).isoformat()
+
+def epochTime(timestamp):
+    """Convert a (local time) ISO timestamp to seconds since the epoch"""
+    timestamp = str(timestamp).replace(" ", "T")
+    fmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in timestamp else "%Y-%m-%dT%H:%M:%S"
+    t = datetime.datetime.strptime(timestamp, fmt)
+    return time.mktime(t.timetuple()) + t.microsecond / 1e6
+
+def isBinaryLog(filename):
+    return path.isdir(filename) and path.exists(path.join(filename, META_FILE))
+
+def openLog(filename, headers, fmt="csv", **kwargs):
+    """
+    Create a new log for writing.  headers is the list of column names, starting with
+    the time column.  The extension for the chosen format is added to filename.
+    Other keyword arguments (flushRows, flushInterval, ...) are passed to the writer
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Log format must be one of {}".format(", ".join(FORMATS)))
+
+    filename = filename + EXTENSIONS[fmt]
+    if fmt == "binary":
+        return BinaryLogWriter(filename, headers, **kwargs)
+    return CsvLogWriter(filename, headers, **kwargs)
+
+
+class LogWriter(object):
+    """
+    Base class for log writers.  The output file stays open and readings are kept in
+    memory, then written in batches (every flushRows readings or flushInterval
+    seconds).  At each checkpoint (every checkpointInterval seconds, and on close)
+    the file is synced to disk.
+
+    Unless journal is False, every reading is also appended to a write-ahead journal
+    and synced to disk before write returns.  If the logging script dies before the
+    log is closed (e.g. power failure), recoverLog restores every reading from it.
+    The journal starts with the position of the output at the last checkpoint,
+    followed by the encoded readings written since then.
+    """
+
+    def __init__(self, filename, headers, flushRows=FLUSH_ROWS, flushInterval=FLUSH_INTERVAL,
+                 checkpointInterval=CHECKPOINT_INTERVAL, journal=True):
+        self.filename  = filename
+        self.headers   = list(headers)
+        self.flushRows = flushRows
+        self.flushInterval      = flushInterval
+        self.checkpointInterval = checkpointInterval
+
+        self.output  = None
+        self.journal = None
+        self.buffer  = []
+        self.rows    = 0        # readings in the output file (not counting the buffer)
+        self.lastFlush      = time.time()
+        self.lastCheckpoint = time.time()
+
+        self._create()
+        if journal:
+            self.journal = open(journalFile(self.filename), "wb")
+            self._resetJournal()
+
+    def write(self, t, values):
+        """ write one reading taken at time t (seconds since the epoch) """
+        row = self._encode(t, values)
+
+        if self.journal:
+            self.journal.write(struct.pack("<I", len(row)) + row)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+        self.buffer.append(row)
+
+        now = time.time()
+        if now - self.lastCheckpoint >= self.checkpointInterval:
+            self.checkpoint()
+        elif len(self.buffer) >= self.flushRows or now - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        """ write buffered readings to the output file """
+        self._writeBuffer()
+
+    def checkpoint(self):
+        """ write buffered readings and sync the output to disk, then clear the journal """
+        self._writeBuffer()
+        os.fsync(self.output.fileno())
+        self._checkpoint()
+        if self.journal:
+            self._resetJournal()
+        self.lastCheckpoint = time.time()
+
+    def close(self):
+        if self.output is None:
+            return
+
+        self.checkpoint()
+        self.output.close()
+        self.output = None
+
+        if self.journal:
+            self.journal.close()
+            os.remove(journalFile(self.filename))
+            self.journal = None
+
+    def _writeBuffer(self):
+        if self.buffer:
+            self.output.write(b"".join(self.buffer))
+            self.rows  += len(self.buffer)
+            self.buffer = []
+        self.output.flush()
+        self.lastFlush = time.time()
+
+    def _resetJournal(self):
+        self.journal.seek(0)
+        self.journal.truncate()
+        self.journal.write(json.dumps(self._position()).encode() + b"\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    # Methods implemented by each format
+    def _create(self):
+        """ create the log and open self.output """
+        raise NotImplementedError
+
+    def _encode(self, t, values):
+        """ return a reading as the bytes appended to the output file """
+        raise NotImplementedError
+
+    def _position(self):
+        """ return the (json serializable) position of the end of the output file """
+        raise NotImplementedError
+
+    def _checkpoint(self):
+        """ called at every checkpoint, after the output file has been synced """
+        pass
+
+
+class CsvLogWriter(LogWriter):
+    """
+    Writes readings as lines of text, one reading per line.  timeFormat converts
+    the time of each reading to text (ISO timestamp by default)
+    """
+
+    def __init__(self, filename, headers, timeFormat=None, **kwargs):
+        self.timeFormat = timeFormat or isoTime
+        LogWriter.__init__(self, filename, headers, **kwargs)
+
+    def _create(self):
+        self.output = open(self.filename, "wb")
+        self.output.write("{}\n".format(",".join(self.headers)).encode())
+        self.output.flush()
+
+    def _encode(self, t, values):
+        return "{},{}\n".format(self.timeFormat(t), ",".join(map(str, values))).encode()
+
+    def _position(self):
+        return {"offset": self.output.tell()}
+
+
+class BinaryLogWriter(LogWriter):
+    """
+    Writes readings to a chunked binary log, see module documentation for layout.
+    Readings are appended to the tail file, which is converted to a chunk at the
+    first checkpoint after it holds chunkSize readings
+    """
+
+    def __init__(self, filename, headers, chunkSize=CHUNK_SIZE, categories=None, integers=None, **kwargs):
+        self.chunkSize  = chunkSize
+        self.chunk      = 0
+        self.categories = categories or {}
+        self.integers   = integers or []
+        LogWriter.__init__(self, filename, headers, **kwargs)
+
+    def _create(self):
+        if not path.isdir(self.filename):
+            os.makedirs(self.filename)
+
+        meta = {"columns": self.headers, "categories": self.categories, "integers": self.integers}
+        with open(path.join(self.filename, META_FILE), "w") as output:
+            json.dump(meta, output)
+
+        self.output = open(self._tailFile(), "ab")
+
+    def _encode(self, t, values):
+        row = np.array([t] + list(values), dtype=np.float64)
+        if len(row) != len(self.headers):
+            raise ValueError("Expected {} values, got {}".format(len(self.headers) - 1, len(row) - 1))
+        return row.tobytes()
+
+    def _position(self):
+        return {"chunk": self.chunk, "offset": self.output.tell()}
+
+    def _checkpoint(self):
+        if self.rows >= self.chunkSize:
+            self.output.close()
+            self._closeChunk()
+            self.output = open(self._tailFile(), "ab")
+
+    def flush(self):
+        LogWriter.flush(self)
+        if self.rows >= self.chunkSize:
+            self.checkpoint()
+
+    def close(self):
+        LogWriter.close(self)
+
+        # remove the tail file if every reading is in a chunk
+        tail = self._tailFile()
+        if path.exists(tail) and path.getsize(tail) == 0:
+            os.remove(tail)
+
+    def writeArray(self, data):
+        """ write a 2-d array of readings (one row per reading, time first) as chunks """
+        data = np.asarray(data, dtype=np.float64)
+        for i in range(0, data.shape[0], self.chunkSize):
+            self._saveChunk(data[i:i + self.chunkSize])
+            self.chunk += 1
+
+        self.output.close()
+        os.remove(self.output.name)
+        self.output = open(self._tailFile(), "ab")
+
+    def _tailFile(self):
+        return path.join(self.filename, TAIL_FILE.format(self.chunk))
+
+    def _saveChunk(self, data):
+        # chunk is written under a temporary name so a partial chunk is never read
+        chunkFile = path.join(self.filename, CHUNK_FILE.format(self.chunk))
+        with open(chunkFile + ".tmp", "wb") as output:
+            np.save(output, np.ascontiguousarray(data.T))
+            output.flush()
+            os.fsync(output.fileno())
+        os.rename(chunkFile + ".tmp", chunkFile)
+
+    def _closeChunk(self):
+        """ convert the tail file into a columnar chunk """
+        tail = self._tailFile()
+        self._saveChunk(_readTail(tail, len(self.headers)))
+        os.remove(tail)
+        self.chunk += 1
+        self.rows = 0
+
+
+def journalFile(filename):
+    """ name of the write-ahead journal of a log """
+    if filename.endswith(EXTENSIONS["binary"]):
+        return path.join(filename, JOURNAL_FILE)
+    return filename + ".journal"
+
+def recoverLog(filename):
+    """
+    Restore the readings of a log that was not closed (e.g. after a power failure)
+    from its journal.  Returns the number of readings recovered
+    """
+    journal = journalFile(filename)
+    if not path.exists(journal):
+        return 0
+
+    with open(journal, "rb") as f:
+        header = f.readline()
+        entries = f.read()
+
+    # an incomplete header means the journal was being cleared, so the log is complete
+    try:
+        position = json.loads(header.decode())
+    except ValueError:
+        os.remove(journal)
+        return 0
+
+    # entries are length prefixed, a trailing partial entry was never acknowledged
+    rows = []
+    i = 0
+    while i + 4 <= len(entries):
+        n = struct.unpack("<I", entries[i:i + 4])[0]
+        if i + 4 + n > len(entries):
+            break
+        rows.append(entries[i + 4:i + 4 + n])
+        i += 4 + n
+
+    if path.isdir(filename):
+        tail = path.join(filename, TAIL_FILE.format(position["chunk"]))
+        chunk = path.join(filename, CHUNK_FILE.format(position["chunk"]))
+        if path.exists(chunk):
+            # the tail was converted to a chunk, so it already holds every reading
+            if path.exists(tail):
+                os.remove(tail)
+            rows = []
+            output = None
+        else:
+            output = open(tail, "ab")
+    else:
+        output = open(filename, "r+b")
+
+    if output is not None:
+        output.seek(position["offset"])
+        output.truncate()
+        output.write(b"".join(rows))
+        output.flush()
+        os.fsync(output.fileno())
+        output.close()
+
+    os.remove(journal)
+    return len(rows)
+
+def _readTail(filename, nColumns):
+    """ read complete rows from a tail file (a trailing partial row is ignored) """
+    data = np.fromfile(filename, dtype=np.float64)
+    nRows = len(data) // nColumns
+    return data[:nRows * nColumns].reshape(nRows, nColumns)
+
+def _blockFiles(filename):
+    """ meta data of a binary log, and its chunk and tail files in order of the readings """
+    with open(path.join(filename, META_FILE)) as f:
+        meta = json.load(f)
+
+    files = sorted(listdir(filename))
+    chunks = {int(f[6:11]): f for f in files if re.match(r"chunk_\d{5}\.npy$", f)}
+    tails  = {int(f[5:10]): f for f in files if re.match(r"tail_\d{5}\.bin$", f)}
+    return meta, [path.join(filename, chunks[i] if i in chunks else tails[i])
+                  for i in sorted(set(chunks) | set(tails))]
+
+def readArray(filename, start=0, count=None):
+    """
+    Read a binary log as a 2-d array with one row per column, starting at reading start
+    (at most count readings, default all).  Returns the meta data (column names and
+    category labels) and the array
+    """
+    meta, files = _blockFiles(filename)
+    nColumns = len(meta["columns"])
+
+    # chunks are mapped rather than read, so only the readings needed are loaded
+    stop = None if count is None else start + count
+    blocks = []
+    row = 0         # index of the first reading of the next block
+    for f in files:
+        if stop is not None and row >= stop:
+            break
+        if f.endswith(".npy"):
+            block = np.load(f, mmap_mode="r")
+        else:
+            block = _readTail(f, nColumns).T
+        if row + block.shape[1] > start:
+            end = None if stop is None else stop - row
+            blocks.append(np.array(block[:, max(0, start - row):end]))
+        row += block.shape[1]
+
+    if not blocks:
+        return meta, np.empty((nColumns, 0))
+    return meta, np.concatenate(blocks, axis=1)
+
+def readLog(filename, epoch=False):
+    """
+    Read a log (either format) into a DataFrame.  Times are returned as ISO
+    timestamps, or as seconds since the epoch if epoch is True
+    """
+    if not isBinaryLog(filename):
+        df = read_csv(filename)
+        if epoch:
+            df[df.columns[0]] = [epochTime(t) for t in df[df.columns[0]]]
+        return df
+
+    meta, data = readArray(filename)
+    return _frame(meta, data, epoch)
+
+def logSize(filename):
+    """
+    Size of a log in the units of the positions of readLogFrom: bytes of a csv log, or
+    readings of a binary log
+    """
+    if not isBinaryLog(filename):
+        return path.getsize(filename)
+
+    meta, files = _blockFiles(filename)
+    size = 0
+    for f in files:
+        if f.endswith(".npy"):
+            size += np.load(f, mmap_mode="r").shape[1]
+        else:
+            size += path.getsize(f) // (8 * len(meta["columns"]))
+    return size
+
+def checkPosition(filename, position):
+    """
+    Check that position (see readLogFrom), e.g. one saved by an earlier run, is the end of
+    a reading of the log, and return the time of that reading (as readLog), or None at the
+    start of the log.  Raises ValueError if the log is shorter than position or position
+    is in the middle of a reading, e.g. because the log was restarted or replaced
+    """
+    if position > logSize(filename):
+        raise ValueError("position {} is beyond the end of {}".format(position, filename))
+
+    if isBinaryLog(filename):
+        if position == 0:
+            return None
+        meta, data = readArray(filename, position - 1, 1)
+        return _frame(meta, data, False).iloc[0, 0]
+
+    with open(filename, "rb") as f:
+        header = f.readline()
+        if position == 0 or position == len(header):
+            return None
+        if position < len(header):
+            raise ValueError("position {} is in the header of {}".format(position, filename))
+
+        # read back to the start of the reading that ends at position
+        data = b""
+        end  = position
+        while True:
+            begin = max(len(header), end - 4096)
+            f.seek(begin)
+            data = f.read(end - begin) + data
+            end  = begin
+            if data.rfind(b"\n", 0, len(data) - 1) >= 0 or begin == len(header):
+                break
+
+    if not data.endswith(b"\n"):
+        raise ValueError("position {} is not the end of a reading of {}".format(position, filename))
+    return _parseCsv(header, data[data.rfind(b"\n", 0, len(data) - 1) + 1:], False).iloc[0, 0]
+
+def readLogFrom(filename, position=0, epoch=False):
+    """
+    Read the readings of a log after position, which is a byte offset into a csv log or
+    a number of readings of a binary log (0 for the start of either).  Only complete
+    readings are returned, so a log that is still being written can be read repeatedly.
+    Returns the DataFrame (as readLog) and the position to continue from.  Raises
+    ValueError if position is not the end of a reading (see checkPosition)
+    """
+    checkPosition(filename, position)
+    if isBinaryLog(filename):
+        meta, data = readArray(filename, position)
+        return _frame(meta, data, epoch), position + data.shape[1]
+
+    with open(filename, "rb") as f:
+        header = f.readline()
+        f.seek(max(position, len(header)))
+        data = f.read()
+
+    # leave a partly written last line for next time
+    data = data[:data.rfind(b"\n") + 1]
+    return _parseCsv(header, data, epoch), max(position, len(header)) + len(data)
+
+def iterLog(filename, rows=CHUNK_SIZE, position=0, epoch=False):
+    """
+    Read a log in blocks of at most rows readings (all if None), starting after position
+    (see readLogFrom).  Yields each block as a DataFrame (as readLog), with the position
+    to continue from after it.  Raises ValueError if position is not the end of a
+    reading (see checkPosition)
+    """
+    checkPosition(filename, position)
+    if isBinaryLog(filename):
+        while True:
+            meta, data = readArray(filename, position, rows)
+            if data.shape[1] == 0:
+                return
+            position += data.shape[1]
+            yield _frame(meta, data, epoch), position
+
+    with open(filename, "rb") as f:
+        header = f.readline()
+        position = max(position, len(header))
+        f.seek(position)
+        while True:
+            lines = list(itertools.islice(f, rows))
+            if lines and not lines[-1].endswith(b"\n"):
+                lines.pop()         # partly written
+            if not lines:
+                return
+            data = b"".join(lines)
+            position += len(data)
+            yield _parseCsv(header, data, epoch), position
+
+def _parseCsv(header, data, epoch):
+    """ DataFrame of the lines (bytes) of a csv log """
+    df = read_csv(io.BytesIO(header + data))
+    if epoch:
+        df[df.columns[0]] = [epochTime(t) for t in df[df.columns[0]]]
+    return df
+
+def _frame(meta, data, epoch):
+    """ DataFrame of the readings of a binary log (see readArray) """
+    columns = meta["columns"]
+
+    df = DataFrame(data.T, columns=columns)
+    for column in meta.get("integers", []):
+        df[column] = df[column].astype(np.int64)
+    for column, labels in meta["categories"].items():
+        df[column] = np.array(labels, dtype=object)[df[column].values.astype(int)]
+
+    if not epoch:
+        times = np.unique(data[0])
+        times = dict(zip(times, [isoTime(t) for t in times]))
+        df[columns[0]] = df[columns[0]].map(times)
+
+    return df
+
+def writeFrame(df, filename, chunkSize=CHUNK_SIZE):
+    """
+    Write a DataFrame to a new binary log.  The first column must hold ISO timestamps.
+    Columns that are not numeric are stored as category codes with their labels
+    """
+    columns = list(df.columns)
+    data = np.empty((len(df), len(columns)))
+    categories = {}
+    integers = []
+
+    times = df[columns[0]].unique()
+    times = dict(zip(times, [epochTime(t) for t in times]))
+    data[:, 0] = df[columns[0]].map(times).values
+
+    for i, column in enumerate(columns[1:], 1):
+        values = to_numeric(df[column], errors="coerce")
+        if values.isnull().sum() == df[column].isnull().sum():
+            data[:, i] = values.values
+            if values.dtype.kind in "iu":
+                integers.append(column)
+        else:
+            labels, codes = np.unique(df[column].astype(str).values, return_inverse=True)
+            categories[column] = list(labels)
+            data[:, i] = codes
+
+    log = BinaryLogWriter(filename, columns, chunkSize, categories, integers, journal=False)
+    log.writeArray(data)
+    log.close()
+
+def exportCsv(filename, csvFile=None):
+    """ write a binary log to csv, by default next to the log with a .csv extension """
+    if csvFile is None:
+        csvFile = re.sub(r"\.npl$", "", filename.rstrip("/\\")) + ".csv"
+
+    readLog(filename).to_csv(csvFile, index=False)
+    return csvFile
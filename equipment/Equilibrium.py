@@ -0,0 +1,249 @@
+"""
+Tests for deciding when readings have reached equilibrium (e.g. the bath or probe
+temperature after a setpoint change)
+
+Every test (an equilibrium criterion) has the same methods, so they can be used in place
+of each other:
+
+    update(value, t=None)   add a reading, taken at time t (s since epoch, default now)
+    isEqualized()           True once the readings have reached equilibrium
+    reset()                 start over, e.g. after the setpoint has changed
+    getSettledValue()       estimate of the value the readings are settling to
+
+EquilibriumMonitor is the original test (the standard deviation of the readings has
+stopped improving for a full window), and DriftCriterion declares equilibrium as soon
+as a trend test shows the readings have stopped drifting, which is usually much sooner
+"""
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from RingBuffer import RingBuffer, WindowExtremes
+
+
+class EquilibriumMonitor():
+    """
+    Readings are at equilibrium once their standard deviation over the last size readings
+    has neither reached a new minimum nor risen by more than 2.5% for size readings
+    """
+
+    def __init__(self, size, name=""):
+
+        self.size     = size
+        self.readings = RingBuffer(size)
+        self.STDs     = WindowExtremes(size, 99.0)  # last size standard deviations
+        self.count    = 0
+        self.name     = name
+        self.nReadings = 0
+
+    def update(self, value, t=None):
+        self.readings.update(value)
+        std = self.readings.getSTD()
+        self.nReadings += 1
+
+        if self.nReadings >= self.size:
+            self.count += 1
+            if std < self.STDs.min():
+                self._print("converging")
+                self.minSTD = std
+                self.count  = 0
+
+            elif std > self.STDs.max() * 1.025:
+                self._print("diverging")
+                self.count  = 0
+
+            elif self.count < self.size:
+                self._print("stabilizing")
+        else:
+            self._print("need more readings")
+
+        self.STDs.update(std)
+
+    def isEqualized(self):
+        return self.count >= self.size
+
+    def reset(self):
+        self.count = 0
+
+    def getSettledValue(self):
+        return self.readings.getAverage()
+
+    def remaining(self):
+        """ minimum number of readings before isEqualized can be True """
+        return max(0, self.size - self.nReadings) + max(0, self.size - self.count)
+
+    def _print(self, msg):
+        val = self.count
+        if self.nReadings < self.size:
+            val = self.nReadings
+        print "{} {} [{}/{}]".format(self.name.rjust(8), msg, val, self.size)
+
+class EquilibriumArray():
+    """
+    Same test as EquilibriumMonitor, for many channels at once: readings are arrays with
+    one value per channel and all channels are updated together. state holds the state
+    of each channel (one of STATES), and a summary is printed at most every logInterval s
+    """
+
+    NEED_MORE   = 0
+    CONVERGING  = 1
+    DIVERGING   = 2
+    STABILIZING = 3
+    EQUALIZED   = 4
+
+    STATES = ["need more readings", "converging", "diverging", "stabilizing", "equalized"]
+
+    def __init__(self, size, channels, name="", logInterval=60):
+
+        self.size        = size
+        self.channels    = channels
+        self.readings    = RingBuffer(size, channels)
+        self.STDs        = WindowExtremes(size, 99.0, channels)    # last size standard deviations
+        self.counts      = np.zeros(channels, dtype=int)
+        self.state       = np.full(channels, self.NEED_MORE, dtype=int)
+        self.name        = name
+        self.nReadings   = 0
+        self.logInterval = logInterval
+        self.lastLog     = 0
+
+    def update(self, values):
+        self.readings.update(values)
+        std = self.readings.getSTD()
+        self.nReadings += 1
+
+        if self.nReadings >= self.size:
+            self.counts += 1
+            converging = std < self.STDs.min()
+            diverging  = ~converging & (std > self.STDs.max() * 1.025)
+            self.counts[converging | diverging] = 0
+
+            self.state[:] = self.STABILIZING
+            self.state[self.counts >= self.size] = self.EQUALIZED
+            self.state[converging] = self.CONVERGING
+            self.state[diverging]  = self.DIVERGING
+        else:
+            self.state[:] = self.NEED_MORE
+
+        self.STDs.update(std)
+
+        if time.time() - self.lastLog >= self.logInterval:
+            self._print()
+
+    def isEqualized(self):
+        return self.counts >= self.size
+
+    def allEqualized(self):
+        return bool(np.all(self.isEqualized()))
+
+    def reset(self):
+        self.counts[:] = 0
+
+    def _print(self):
+        self.lastLog = time.time()
+        if self.nReadings < self.size:
+            print "{} need more readings [{}/{}]".format(self.name.rjust(8), self.nReadings, self.size)
+            return
+
+        states = ["{} {}".format(n, self.STATES[i]) for i, n in enumerate(np.bincount(self.state, minlength=5)) if n]
+        print "{} {} [min {}/{}]".format(self.name.rjust(8), ", ".join(states), min(self.counts.min(), self.size), self.size)
+
+
+class DriftCriterion():
+    """
+    Readings are at equilibrium once they have stopped drifting: a straight line is fitted
+    to the last window readings, and the upper confidence bound of its slope (|slope| + z
+    standard errors) must be below maxDrift (units per second). The default z gives a
+    one-sided 95% bound. The last history readings (default 10 windows) are kept to
+    project the settled value
+    """
+
+    TAU_STEPS = 100     # time constants tried in each pass of the search in getSettledValue
+    MAX_TAU   = 5.0     # longest time constant tried, in units of the time span of the readings
+    MIN_GAIN  = 10.0    # minimum reduction of the squared residuals by the fit, in units of their variance
+
+    def __init__(self, window, maxDrift, z=1.645, name="", history=None):
+        self.window   = window
+        self.maxDrift = maxDrift
+        self.z        = z
+        self.name     = name
+        self.history  = 10 * window if history is None else max(window, history)
+        self.times    = deque(maxlen=self.history)
+        self.values   = deque(maxlen=self.history)
+
+    def update(self, value, t=None):
+        self.times.append(time.time() if t is None else t)
+        self.values.append(value)
+
+    def reset(self):
+        self.times.clear()
+        self.values.clear()
+
+    def getDrift(self):
+        """ returns the slope (units/s) of the last window readings and its standard error """
+        if len(self.values) < 3:
+            return float("nan"), float("inf")
+
+        t   = np.array(self.times, dtype=float)[-self.window:]
+        y   = np.array(self.values, dtype=float)[-self.window:]
+        t  -= t.mean()
+        sxx = (t ** 2).sum()
+        if sxx == 0:
+            return float("nan"), float("inf")
+
+        slope = (t * (y - y.mean())).sum() / sxx
+        resid = y - y.mean() - slope * t
+        return slope, math.sqrt((resid ** 2).sum() / (len(y) - 2) / sxx)
+
+    def isEqualized(self):
+        if len(self.values) < self.window:
+            return False
+        slope, err = self.getDrift()
+        return abs(slope) + self.z * err < self.maxDrift
+
+    def getSettledValue(self):
+        """
+        Projects the final value by a least squares fit of c + A * exp(-t / tau) to the kept
+        readings, and returns c. For each tau the fit is linear in c and A, so tau is found
+        by searching log spaced values from the reading interval to MAX_TAU times the span
+        of the readings, refined twice around the best one. If the readings show no
+        exponential approach (the best tau is the longest tried, or the fit is no better
+        than the noise), returns the mean of the last window readings
+        """
+        y = np.array(self.values, dtype=float)
+        if len(y) < 3:
+            return y.mean() if len(y) else float("nan")
+
+        t    = np.array(self.times, dtype=float)
+        t   -= t[0]
+        span = t[-1]
+        mean = y[-self.window:].mean()
+        if span <= 0:
+            return mean
+
+        yc = y - y.mean()
+        lo = math.log(span / (len(t) - 1))
+        hi = math.log(self.MAX_TAU * span)
+        for i in range(3):
+            taus = np.exp(np.linspace(lo, hi, self.TAU_STEPS))
+            e    = np.exp(-t[:, None] / taus)
+            e   -= e.mean(axis=0)
+            sxx  = (e ** 2).sum(axis=0)
+            sxy  = (e * yc[:, None]).sum(axis=0)
+
+            # reduction of the sum of squared residuals by the exponential term
+            gain = sxy ** 2 / np.where(sxx > 0, sxx, np.inf)
+            best = gain.argmax()
+            if i == 0 and best == self.TAU_STEPS - 1:
+                return mean
+
+            step = (hi - lo) / (self.TAU_STEPS - 1)
+            lo   = math.log(taus[best]) - step
+            hi   = math.log(taus[best]) + step
+
+        # no significant exponential term, e.g. readings already settled before the last reset
+        if gain[best] < self.MIN_GAIN * ((yc ** 2).sum() - gain[best]) / max(len(y) - 3, 1):
+            return mean
+        A = sxy[best] / sxx[best]
+        return y.mean() - A * np.exp(-t / taus[best]).mean()
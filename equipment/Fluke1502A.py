@@ -1,5 +1,7 @@
 import serial
-import configparser
+
+from SerialIO import SerialRequest, LatencyStats
+from PortDiscovery import findPort, portName, claim, release
 
 # Class for Fluke 1502A Probe reader with Serial Interface
 #   - Serial interface should be configured to 9600 BAUD, Full Duplex
@@ -12,50 +14,50 @@ class Fluke1502A:
     TIMEOUT_INIT        = 0.25      # time to wait for first character of response
     TIMEOUT_CONSECUTIVE = 0.05      # max time to wait for each subsequent character
     CHARS_PER_READ      = 16        # reads response 16 bytes at a time
+    EOL                 = "\n"      # character ending each line of a response
+    # Number of lines in the response to each query (including the echoed command), so
+    # a request finishes as soon as the last line arrives.  Other commands end on timeout
+    RESPONSE_LINES      = {"t": 2, "*idn?": 2, "*idn": 2, "*ver": 2, "pr": 2, "sc": 2,
+                           "r0": 2, "a4": 2, "b4": 2, "a7": 2, "b7": 2, "c7": 2}
 
     def __init__(self, units="c"):
         self.units = units
         self.conn  = None
+        self.stats = LatencyStats() # response times of each command
 
     # Connects and opens serial connection to specified port
-    # port must be an integer (usually between 1 and 12)
-    # use a value of 0 (default) for the port to try auto-detection of the port)
+    # port is a port name (e.g. "COM12" or "/dev/ttyUSB0") or COM port number (e.g. 12 = COM12)
+    # use a value of 0 (default) to search for the device (see PortDiscovery)
     def connect(self, port=0, baud=9600, timeout=2.0):
 
-        cfg  = configparser.ConfigParser()
-        cfg.read("lab.cfg")
-
-        if port == 0: # default, no port specified
-            port = cfg["Fluke1502A"].getint("Port")
-            portList = [port] + range(1, 13)
-        else:
-            portList = [port]
-
-        for p in portList:
-            print "Attempting to connect to port {} ...".format(p),
-            if self.tryPort(p, baud, timeout):
-                print "Connected"
-
-                # we connected to something, now request identifier to verify it is the 1502A
-                res = self.sendCmd("*IDN?")
-                if len(res) > 0:
-                    if "HART,1502A" in res[0]:
-                        print "  Correctly identified as Fluke 1502A"
-                        cfg["Fluke1502A"]["Port"] = str(p)
-                        with open("lab.cfg", "w") as cfgFile:
-                            cfg.write(cfgFile)
-                        return True
-                    else:
-                        print "  Failed to identify as Fluke 1502A"
+        if port == 0: # default, no port specified, search for the device
+            port = findPort("Fluke1502A")
+            if port is None:
+                print "Fluke 1502A not found"
+                return False
+
+        print "Attempting to connect to port {} ...".format(port),
+        if self.tryPort(port, baud, timeout):
+            print "Connected"
+
+            # we connected to something, now request identifier to verify it is the 1502A
+            res = self.sendCmd("*IDN?")
+            if len(res) > 0:
+                if "HART,1502A" in res[0]:
+                    print "  Correctly identified as Fluke 1502A"
+                    claim(port)
+                    return True
                 else:
-                    print "  No response"
+                    print "  Failed to identify as Fluke 1502A"
             else:
-                print "Failed"
+                print "  No response"
+        else:
+            print "Failed"
 
         return False
 
     def tryPort(self, port, baud, timeout):
-        port = "COM{}".format(port)
+        port = portName(port)
         try:
             self.conn = serial.Serial(port=port, baudrate=baud, timeout=timeout, rtscts=True, write_timeout=timeout)
             self.sendCmd("u={}".format(self.units))
@@ -73,15 +75,23 @@ class Fluke1502A:
 
     # Closes the serial connection
     def disconnect(self):
+        release(self.conn.port)
         self.conn.close()
 
     # Sends specified command to the Fluke1502A. Paramater cmd should be a string with no newline character
     def sendCmd(self, cmd, nBytes=4096):
-        cmd += self.ENDL
-        cmd = bytearray(cmd)
+        return self.sendCmdAsync(cmd).wait()
+
+    # Sends command without waiting for the response. Returns a SerialRequest (see SerialIO)
+    # whose result is the response, after applying the function parse if given
+    def sendCmdAsync(self, cmd, parse=None):
+        return SerialRequest(self.conn, cmd + self.ENDL, self.TIMEOUT_INIT, self.TIMEOUT_CONSECUTIVE,
+                             parse=lambda res: self._parse(res, parse), lines=self._responseLines(cmd),
+                             eol=self.EOL, stats=self.stats)
 
-        self._send(cmd)
-        return self._recv_all()
+    # Expected number of lines in the response to cmd, or None if unknown
+    def _responseLines(self, cmd):
+        return self.RESPONSE_LINES.get(cmd.strip().lower())
 
     # Raw serial write - use method sendCmd unless you want to send an exact set of bytes
     def _send(self, bytes):
@@ -94,32 +104,25 @@ class Fluke1502A:
     # This method returns faster than using a single timeout to wait for the full response
     # Returns result as list of strings, each string being one line of the response
     def _recv_all(self):
-        res = ""
-        originalTimeout   = self.conn.timeout
-        self.conn.timeout = self.TIMEOUT_INIT
+        return SerialRequest(self.conn, None, self.TIMEOUT_INIT, self.TIMEOUT_CONSECUTIVE,
+                             parse=self._parse).wait()
 
-        # check for response
-        byte = self.conn.read()
-        if not byte:    # tests if response is empty
+    # Splits response into lines, dropping the echoed command
+    @staticmethod
+    def _parse(res, parse=None):
+        if not res:    # tests if response is empty
             return ""
-        else:
-            res += str(byte)
-
-        self.conn.timeout = self.TIMEOUT_CONSECUTIVE
-
-        # continuously read bytes until buffer is empty
-        while byte:
-            byte = self.conn.read()
-            res += str(byte)
-
-        self.conn.timeout = originalTimeout
-        return res.splitlines()[1:]
+        res = res.splitlines()[1:]
+        if parse:
+            res = parse(res)
+        return res
 
     # Reads temperature of bath, returned as string
     def readTemp(self):
-        res  = self.sendCmd("t")
-        temp = res[0][2:12].strip()
-        return temp
+        return self.readTempAsync().wait()
+
+    def readTempAsync(self):
+        return self.sendCmdAsync("t", lambda res: res[0][2:12].strip())
 
     # set units of measurements for the device
     # valid options for units are as follows (case insensitive):
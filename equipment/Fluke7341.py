@@ -1,5 +1,7 @@
 import serial
-import configparser
+
+from SerialIO import SerialRequest, LatencyStats
+from PortDiscovery import findPort, portName, claim, release
 
 # Class for Fluke 7341 Calibration Bath with Serial Interface
 #   - Reads and writes are slow on this device (max 2400 BAUD)
@@ -12,6 +14,10 @@ class Fluke7341:
     TIMEOUT_INIT        = 2.00          # time to wait for first character of response
     TIMEOUT_CONSECUTIVE = 0.25          # max time to wait for each subsequent character
     CHARS_PER_READ      = 16            # reads response 16 bytes at a time
+    EOL                 = "\n"          # character ending each line of a response
+    # Number of lines in the response to each query (including the echoed command), so
+    # a request finishes as soon as the last line arrives.  Other commands end on timeout
+    RESPONSE_LINES      = {"t": 2, "*ver": 2, "s": 2}
 
     # Setpoint Min/Max values are in Celsius
     # These values are safety constraints, they can be changed as necessary
@@ -21,45 +27,41 @@ class Fluke7341:
     def __init__(self, units="c"):
         self.units = units
         self.conn = None
+        self.stats = LatencyStats() # response times of each command
 
     # Connects and opens serial connection to specified port
-    # port must be a string in the form COM* where * is one or more digits - ex. "COM7" or "COM12"
+    # port is a port name (e.g. "COM12" or "/dev/ttyUSB0") or COM port number (e.g. 12 = COM12)
+    # use a value of 0 (default) to search for the device (see PortDiscovery)
     def connect(self, port=0, baud=2400, timeout=2.0):
 
-        cfg  = configparser.ConfigParser()
-        cfg.read("lab.cfg")
+        if port == 0: # default, no port specified, search for the device
+            port = findPort("Fluke7341")
+            if port is None:
+                print "Fluke 7341 not found"
+                return False
 
-        if port == 0: # default, no port specified
-            port = cfg["Fluke7341"].getint("Port")
-            portList = [port] + range(1, 13)
-        else:
-            portList = [port]
-
-        for p in portList:
-            print "Attempting to connect to port {} ...".format(p),
-            if self.tryPort(p, baud, timeout):
-                print "Connected"
-
-                # we connected to something, now request identifier to verify it is the 7341
-                res = self.sendCmd("*VER")
-                if len(res) > 0:
-                    if "ver.7341,1.08" in res[0]:
-                        print "  Correctly identified as Fluke 7431"
-                        cfg["Fluke7341"]["Port"] = str(p)
-                        with open("lab.cfg", "w") as cfgFile:
-                            cfg.write(cfgFile)
-                        return True
-                    else:
-                        print "  Failed to identify as Fluke 7431"
+        print "Attempting to connect to port {} ...".format(port),
+        if self.tryPort(port, baud, timeout):
+            print "Connected"
+
+            # we connected to something, now request identifier to verify it is the 7341
+            res = self.sendCmd("*VER")
+            if len(res) > 0:
+                if "ver.7341,1.08" in res[0]:
+                    print "  Correctly identified as Fluke 7431"
+                    claim(port)
+                    return True
                 else:
-                    print "  No response"
+                    print "  Failed to identify as Fluke 7431"
             else:
-                print "Failed"
+                print "  No response"
+        else:
+            print "Failed"
 
         return False
 
     def tryPort(self, port, baud, timeout):
-        port = "COM{}".format(port)
+        port = portName(port)
         try:
             self.conn = serial.Serial(port=port, baudrate=baud, timeout=timeout, rtscts=True, write_timeout=timeout)
             self.setUnits("c")
@@ -77,15 +79,23 @@ class Fluke7341:
 
     # Closes the serial connection
     def disconnect(self):
+        release(self.conn.port)
         self.conn.close()
 
     # Sends specified command to the Fluke7341. Paramater cmd should be a string with no newline character
     def sendCmd(self, cmd, nBytes=4096):
-        cmd += self.ENDL
-        cmd = bytearray(cmd)
+        return self.sendCmdAsync(cmd).wait()
+
+    # Sends command without waiting for the response. Returns a SerialRequest (see SerialIO)
+    # whose result is the response, after applying the function parse if given
+    def sendCmdAsync(self, cmd, parse=None):
+        return SerialRequest(self.conn, cmd + self.ENDL, self.TIMEOUT_INIT, self.TIMEOUT_CONSECUTIVE,
+                             parse=lambda res: self._parse(res, parse), lines=self._responseLines(cmd),
+                             eol=self.EOL, stats=self.stats)
 
-        self._send(cmd)
-        return self._recv_all()
+    # Expected number of lines in the response to cmd, or None if unknown
+    def _responseLines(self, cmd):
+        return self.RESPONSE_LINES.get(cmd.strip().lower())
 
     # Raw serial write - use method sendCmd unless you want to send an exact set of bytes
     def _send(self, bytes):
@@ -97,33 +107,25 @@ class Fluke7341:
     # waits TIMEOUT_CONSECUTIVE between each remaining byte of response.
     # This method returns faster than using a single timeout to wait for the full response
     def _recv_all(self):
-        res = ""
-        originalTimeout   = self.conn.timeout
-        self.conn.timeout = self.TIMEOUT_INIT
+        return SerialRequest(self.conn, None, self.TIMEOUT_INIT, self.TIMEOUT_CONSECUTIVE,
+                             parse=self._parse).wait()
 
-        # check for response
-        byte = self.conn.read()
-        if not byte: # tests if response is empty
+    # Splits response into lines, dropping the echoed command
+    @staticmethod
+    def _parse(res, parse=None):
+        if not res: # tests if response is empty
             return ""
-        else:
-            res += str(byte)
-
-        self.conn.timeout = self.TIMEOUT_CONSECUTIVE
-
-        # continuously read bytes until buffer is empty
-        while byte:
-            byte = self.conn.read()
-            res += str(byte)
-
-        self.conn.timeout = originalTimeout
-        return res.splitlines()[1:]
+        res = res.splitlines()[1:]
+        if parse:
+            res = parse(res)
+        return res
 
     # Reads temperature of bath, returned as string
     def readTemp(self):
-        res  = self.sendCmd("t")
-        #print res
-        temp = res[0][2:10].strip()
-        return temp
+        return self.readTempAsync().wait()
+
+    def readTempAsync(self):
+        return self.sendCmdAsync("t", lambda res: res[0][2:10].strip())
 
     # set units of measurements for the device
     # valid options for units are as follows (case insensitive):
@@ -1,6 +1,8 @@
 import visa
 import time
 
+import numpy as np
+
 # Controller class for Keysight 34972A Data Acquisition Unit
 
 class Keysight34972A():
@@ -18,6 +20,9 @@ class Keysight34972A():
     MODE_RESISTANCE  = 0
     MODE_TEMPERATURE = 1
 
+    MEMORY_SIZE   = 50000   # readings held in the reading memory during a hardware-timed scan
+    POLL_INTERVAL = 0.1     # time (s) between checks of the reading memory in fetchScans
+
     def __init__(self):
         self.rm = visa.ResourceManager()
         self.instance = None
@@ -26,6 +31,10 @@ class Keysight34972A():
         # valid sensors are 1 through 22
         self.scanList = []
 
+        # hardware-timed scan state (see startScan)
+        self.scanSize  = 0      # channels in each scan
+        self.scanStart = None   # host time when the scan was started
+
     def connect(self):
 
         self.instance = self.rm.open_resource(self.ADDRESS)
@@ -54,6 +63,11 @@ class Keysight34972A():
     def _query(self, cmd):
         return self.instance.query(cmd)
 
+    # query a comma separated list of numbers, returned as a numpy array
+    # (the 34972A has no binary number format, readings are always sent as ASCII)
+    def _queryValues(self, cmd):
+        return np.array(self._query(cmd).split(','), dtype=float)
+
     # initializes J-type thermocouples to be read in degrees Celsius
     # scanList is a list of probe IDs (can be 1 to 22)
     # ex: initialize([1]), initialize(range(1, 5)), initialize([1, 4, 6])
@@ -76,29 +90,83 @@ class Keysight34972A():
         probeString = "201:220,301:320"
 
 
-        self._write("format:reading:channel 1;alarm 1;unit 1;time:type rel")
+        self._write("format:reading:channel 1;alarm 1;unit 1;time 0;time:type rel")
         if mode == self.MODE_TEMPERATURE:
             self._write("configure:temperature tc,j,DEF,(@{})".format(probeString))
         elif mode == self.MODE_RESISTANCE:
             self._write("configure:resistance (@{})".format(probeString))
+        self._write("trigger:source immediate")
         self._write("trigger:count 1")
 
-    # read a float value from each sensor in scanList, returned as a list
-    def readValues(self, probeList):
+    # read a float value from each sensor in scanList, returned as a numpy array
+    def readValues(self, probeList=None):
         self._write("initiate")
-        temps = self._query("fetch?").split(',')
-        return temps
+        return self._queryValues("fetch?")
 
     def readResistances(self, probeList):
-        res = self._query("measure:resistance? (@{})".format(probeList))
-        return map(float, [temp for temp in res.split(',')])
+        return self._queryValues("measure:resistance? (@{})".format(probeList))
+
+    # Starts a hardware-timed scan: the DAQ scans channelList every interval seconds using its
+    # own trigger timer and keeps the readings (with their time stamps) in reading memory
+    # until they are collected with fetchScans. count is the number of scans, 0 scans until
+    # stopScan is called. channelList uses the same format as readResistances
+    def startScan(self, channelList, interval, count=0, mode=MODE_RESISTANCE):
+        self._write("abort")
+        self._write("*CLS")
+
+        if mode == self.MODE_TEMPERATURE:
+            self._write("configure:temperature tc,j,DEF,(@{})".format(channelList))
+        elif mode == self.MODE_RESISTANCE:
+            self._write("configure:resistance (@{})".format(channelList))
+        self._write("route:scan (@{})".format(channelList))
+        self.scanSize = int(self._query("route:scan:size?"))
+
+        if count and count * self.scanSize > self.MEMORY_SIZE:
+            print "[WARNING] {} scans will not fit in reading memory, call fetchScans during the scan".format(count)
+
+        # readings are returned as value,time pairs, with time in seconds since the scan started
+        self._write("format:reading:channel 0;alarm 0;unit 0;time 1;time:type rel")
+        self._write("trigger:source timer")
+        self._write("trigger:timer {}".format(interval))
+        self._write("trigger:count {}".format(count if count else "infinity"))
+        self._write("initiate")
+        self.scanStart = time.time()
+
+    # Removes the completed scans (the oldest maxScans of them if given) from reading memory,
+    # waiting up to timeout seconds (forever if None) until at least minScans are available.
+    # Returns (times, values) where times holds the time (s since epoch) of each scan from the
+    # DAQ clock, and values has one row per scan and one column per channel
+    def fetchScans(self, minScans=0, timeout=None, maxScans=None):
+        t0 = time.time()
+        while True:
+            nScans = int(self._query("data:points?")) // self.scanSize
+            if nScans >= minScans or (timeout is not None and time.time() - t0 > timeout):
+                break
+            time.sleep(self.POLL_INTERVAL)
+        if maxScans is not None:
+            nScans = min(nScans, maxScans)
+
+        if nScans == 0:
+            return np.empty(0), np.empty((0, self.scanSize))
+
+        data = self._queryValues("data:remove? {}".format(nScans * self.scanSize))
+        data = data.reshape(nScans, self.scanSize, 2)
+        return self.scanStart + data[:, 0, 1], data[:, :, 0]
+
+    # Stops a hardware-timed scan and restores the reading format and trigger settings used by
+    # readValues and readResistances. Readings not yet fetched stay in reading memory
+    def stopScan(self):
+        self._write("abort")
+        self._write("format:reading:channel 0;alarm 0;unit 0;time 0")
+        self._write("trigger:source immediate")
+        self._write("trigger:count 1")
 
     # read float values for each sensor, but return it in a dict format, ex:
     # {"1": 20.1, "2": 32.5, "4": 30.6}
     def readValuesDict(self):
         tempDict = {}
         self._write("initiate")
-        readings = self._query("fetch?").split(',')
+        readings = self._queryValues("fetch?")
         i = 0
         for probe in self.scanList:
             tempDict[str(probe)] = float(readings[i])
@@ -118,8 +186,7 @@ if __name__ == "__main__":
     t0 = time.time()
     for probeList in ["101:120", "201:220","301:320"]:
 
-        res = keysight._query("measure:resistance? (@{})".format(probeList))
-        print map(float, [temp for temp in res.split(',')])
+        print keysight.readResistances(probeList)
     print time.time() - t0
     exit(1)
 
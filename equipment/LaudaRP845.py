@@ -1,8 +1,16 @@
-import configparser
 import re
 import serial
+import time
+from collections import namedtuple
 from numpy import diff, concatenate, floor
 
+from SerialIO import SerialRequest, LatencyStats
+from PortDiscovery import findPort, portName, claim, release
+
+# Bath readings returned by LaudaRP845.queryMany. Values that were not queried (or
+# returned an error) are None, time is when the replies were received
+BathState = namedtuple("BathState", ["time", "bathTemp", "extTemp", "level", "setpoint", "pump", "maxTemp", "minTemp"])
+
 # Class for LAUDA RP 845 Recirculating Bath with Serial Interface
 #   - Temperatures are read in Celsius
 #   - Serial interface should be configured to 9600 BAUD, 1 stop bit, no parity, 8 data bits
@@ -13,6 +21,8 @@ class LaudaRP845:
     TIMEOUT_INIT        = 2.00          # time to wait for first character of response
     TIMEOUT_CONSECUTIVE = 0.25          # max time to wait for each subsequent character
     CHARS_PER_READ      = 16            # reads response 16 bytes at a time
+    EOL                 = "\n"          # character ending each line of a response
+    RESPONSE_LINES      = 1             # every command is answered with a single line
 
     # Setpoint Min/Max values are in Celsius
     # These values are universal constraints, they can be changed as necessary
@@ -20,6 +30,17 @@ class LaudaRP845:
     SETPOINT_MAX        =  50
     SETPOINT_MIN        =  -25 # If Min < 0, make sure there is enough glycol in the bath
 
+    # Read commands which can be combined with queryMany, by BathState field
+    QUERIES             = {
+        "bathTemp": "in pv 10",     # internal sensor temperature
+        "extTemp":  "in pv 13",     # external sensor temperature
+        "level":    "in pv 05",     # bath level
+        "setpoint": "in sp 00",
+        "pump":     "in sp 01",     # pump level
+        "maxTemp":  "in sp 04",     # upper temperature limit (TiH)
+        "minTemp":  "in sp 05",     # lower temperature limit (TiL)
+    }
+
     ERRORS              = {
         "2":  "Wrong input",
         "3":  "Wrong command",
@@ -41,47 +62,43 @@ class LaudaRP845:
         self.err  = False
         self.bathID = None
         self.temperatureLimits = None
+        self.stats = LatencyStats()     # response times of each command
 
 
     # Connects and opens serial connection to specified port
-    # port must be an integer corresponding to the desired port (e.g. 12 = COM12)
+    # port is a port name (e.g. "COM12" or "/dev/ttyUSB0") or COM port number (e.g. 12 = COM12)
+    # use a value of 0 (default) to search for the device (see PortDiscovery)
     def connect(self, port=0, baud=9600, timeout=2.0):
         """Scan serial ports for device and attempt connection."""
-        cfg  = configparser.ConfigParser()
-        cfg.read("lab.cfg")
-
-        if port == 0: # default, no port specified
-            port = cfg["LaudaRP845"].getint("Port")
-            portList = [port] + range(1, 13)
-        else:
-            portList = [port]
-
-        for p in portList:
-            print "Attempting to connect to port {} ...".format(p),
-            if self.tryPort(p, baud, timeout):
-                print "Connected"
-
-                # we connected to something, now request identifier to verify it is the RP845
-                res = self.sendCmd("TYPE")
-                if len(res) > 0:
-                    if "RP  845" in res[0]:
-                        print "  Correctly identified as Lauda RP 845"
-                        cfg["LaudaRP845"]["Port"] = str(p)
-                        with open("lab.cfg", "w") as cfgFile:
-                            cfg.write(cfgFile)
-                        return True
-                    else:
-                        print "  Failed to identify as Lauda RP 845"
+        if port == 0: # default, no port specified, search for the device
+            port = findPort("LaudaRP845")
+            if port is None:
+                print "Lauda RP 845 not found"
+                return False
+
+        print "Attempting to connect to port {} ...".format(port),
+        if self.tryPort(port, baud, timeout):
+            print "Connected"
+
+            # we connected to something, now request identifier to verify it is the RP845
+            res = self.sendCmd("TYPE")
+            if len(res) > 0:
+                if "RP  845" in res[0]:
+                    print "  Correctly identified as Lauda RP 845"
+                    claim(port)
+                    return True
                 else:
-                    print "  No response"
+                    print "  Failed to identify as Lauda RP 845"
             else:
-                print "Failed"
+                print "  No response"
+        else:
+            print "Failed"
 
         return False
 
     def tryPort(self, port, baud, timeout):
         """Attempt to connect to a specific port."""
-        port = "COM{}".format(port)
+        port = portName(port)
         try:
             self.conn = serial.Serial(port=port, baudrate=baud, timeout=timeout, rtscts=True, write_timeout=timeout)
             self._recv_all()            # clears read buffer
@@ -98,16 +115,23 @@ class LaudaRP845:
     # Closes the serial connection
     def disconnect(self):
         """Close serial connection."""
+        release(self.conn.port)
         self.conn.close()
 
     # Sends specified command to the LaudaRP845. Paramater cmd should be a string with no newline character
     def sendCmd(self, cmd, nBytes=4096, raw=False):
         """Send string over serial connection and return response."""
-        cmd += self.ENDL
-        cmd = bytearray(cmd)
+        return self.sendCmdAsync(cmd).wait()
+
+    def sendCmdAsync(self, cmd, parse=None):
+        """Send string without waiting, return a SerialRequest for the (parsed) response."""
+        return SerialRequest(self.conn, cmd + self.ENDL, self.TIMEOUT_INIT, self.TIMEOUT_CONSECUTIVE,
+                             parse=lambda res: self._parse(res, parse), lines=self.RESPONSE_LINES,
+                             eol=self.EOL, stats=self.stats)
 
-        self._send(cmd)
-        res = self._recv_all()
+    def _parse(self, res, parse=None):
+        """Split response into lines, check for errors and apply parse."""
+        res = res.splitlines() if res else ""
 
         # check for errors
         error = re.search(r"ERR_(\d+)", res[0])
@@ -118,6 +142,8 @@ class LaudaRP845:
 
         # if no errors, return result
         self.err = False
+        if parse:
+            res = parse(res)
         return res
 
     # Raw serial write - use method sendCmd unless you want to send an exact set of bytes
@@ -131,26 +157,8 @@ class LaudaRP845:
     # This method returns faster than using a single timeout to wait for the full response
     def _recv_all(self, asLines=True):
         """Return the entirety of the read buffer."""
-        res = ""
-        originalTimeout   = self.conn.timeout
-        self.conn.timeout = self.TIMEOUT_INIT
-
-        # check for response
-        byte = self.conn.read()
-        if not byte: # tests if response is empty
-            return ""
-        else:
-            res += str(byte)
-
-        self.conn.timeout = self.TIMEOUT_CONSECUTIVE
-
-        # continuously read bytes until buffer is empty
-        while byte:
-            byte = self.conn.read()
-            res += str(byte)
-
-        self.conn.timeout = originalTimeout
-        if asLines:
+        res = SerialRequest(self.conn, None, self.TIMEOUT_INIT, self.TIMEOUT_CONSECUTIVE).wait()
+        if asLines and res:
             res = res.splitlines()
         return res
 
@@ -373,10 +381,12 @@ class LaudaRP845:
         """
 
         if recalculate or not self.temperatureLimits:
-            TiL = float(self.sendCmd('in sp 05')[0].strip())
-            TiL = max([TiL, self.SETPOINT_MIN])
-            TiH = float(self.sendCmd('in sp 04')[0].strip())
-            TiH = min([TiH, self.SETPOINT_MAX])
+            state = self.queryMany(["minTemp", "maxTemp"])
+            if state.minTemp is None or state.maxTemp is None:
+                # not cached, so the limits are read again next time
+                raise ValueError("Failed to read bath temperature limits")
+            TiL = max([state.minTemp, self.SETPOINT_MIN])
+            TiH = min([state.maxTemp, self.SETPOINT_MAX])
 
             self.temperatureLimits = (TiL, TiH)
 
@@ -384,13 +394,17 @@ class LaudaRP845:
 
     def getBathTemp(self):
         """Get temperature measured by internal sensor."""
-        res = self.sendCmd("in pv 10")[0].strip()
-        return float(res)
+        return self.getBathTempAsync().wait()
+
+    def getBathTempAsync(self):
+        return self.sendCmdAsync("in pv 10", self._parseFloat)
 
     def getExtTemp(self):
         """Get temperature measured by external sensor."""
-        res = self.sendCmd("in pv 13")[0].strip()
-        return float(res)
+        return self.getExtTempAsync().wait()
+
+    def getExtTempAsync(self):
+        return self.sendCmdAsync("in pv 13", self._parseFloat)
 
     def getBathLevel(self):
         """Get current bath level."""
@@ -399,8 +413,53 @@ class LaudaRP845:
 
     def getSetpoint(self):
         """Get current setpoint."""
-        res = self.sendCmd("in sp 00")[0].strip()
-        return float(res)
+        return self.getSetpointAsync().wait()
+
+    def getSetpointAsync(self):
+        return self.sendCmdAsync("in sp 00", self._parseFloat)
+
+    @staticmethod
+    def _parseFloat(res):
+        return float(res[0].strip())
+
+    def queryMany(self, fields):
+        """Read several values in one exchange, returns a BathState (see QUERIES for fields)."""
+        return self.queryManyAsync(fields).wait()
+
+    def queryManyAsync(self, fields):
+        """
+        Send the read commands for fields back to back without waiting for each reply.
+        Returns a SerialRequest whose result is a BathState
+        """
+        unknown = [field for field in fields if field not in self.QUERIES]
+        if unknown:
+            raise ValueError("Unknown bath quantities: {}".format(", ".join(unknown)))
+
+        cmd = "".join([self.QUERIES[field] + self.ENDL for field in fields])
+        return SerialRequest(self.conn, cmd, self.TIMEOUT_INIT, self.TIMEOUT_CONSECUTIVE,
+                             parse=lambda res: self._parseMany(res, fields), lines=len(fields),
+                             eol=self.EOL, stats=self.stats)
+
+    def _parseMany(self, res, fields):
+        """Match the replies to fields in order, errors and missing replies give None."""
+        lines  = res.splitlines() if res else []
+        values = dict.fromkeys(BathState._fields)
+        values["time"] = time.time()
+
+        for i, field in enumerate(fields):
+            if i >= len(lines):
+                self.warning("No reply to '{}'".format(self.QUERIES[field]))
+                continue
+
+            error = re.search(r"ERR_(\d+)", lines[i])
+            if error:
+                self.warning("{}: {}".format(self.QUERIES[field], self.ERRORS.get(error.groups()[0], lines[i])))
+                continue
+
+            values[field] = float(lines[i].strip())
+
+        self.err = None in [values[field] for field in fields]
+        return BathState(**values)
 
     def getPumpLevel(self):
         """Get current pump level."""
@@ -458,6 +517,7 @@ if __name__ == "__main__":
         exit(1)
 
     lauda.setSetpoint(19.5)
+    print lauda.queryMany(["bathTemp", "extTemp", "setpoint"])
     print lauda.getBathTemp()
     #print lauda.getExtTemp()
     print lauda.getBathLevel()
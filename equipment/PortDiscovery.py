@@ -0,0 +1,167 @@
+"""
+Finds the serial port each instrument (Fluke1502A, Fluke7341, LaudaRP845) is
+connected to.
+
+findPort(name) returns the port of an instrument, trying in order:
+  1. the port last used by the USB adapter with the same serial number (CACHE_FILE)
+  2. the port saved in lab.cfg
+  3. a scan of all serial ports. Ports are probed in parallel, and every known
+     instrument found in the scan is remembered, so connecting the remaining
+     instruments does not need another scan
+
+Ports are given as names ("COM5", "/dev/ttyUSB0"); integers are COM port numbers
+as in lab.cfg.
+"""
+import glob
+import json
+import os
+import sys
+
+from multiprocessing.pool import ThreadPool
+
+import configparser
+import serial
+
+from SerialIO import SerialRequest
+
+try:
+    from serial.tools.list_ports import comports
+except ImportError:
+    comports = None
+
+CONFIG_FILE   = "lab.cfg"
+CACHE_FILE    = "ports.json"    # USB serial numbers of the instruments, and their last ports
+PROBE_TIMEOUT = 1.0             # time (s) to wait for a reply when identifying a port
+ENDL          = "\r"
+
+# Command used to identify each instrument, the text its reply must contain, the
+# number of lines in the reply (Fluke instruments echo the command) and baud rate
+SIGNATURES = {
+    "Fluke1502A": {"cmd": "*IDN?", "match": "HART,1502A",    "lines": 2, "baud": 9600},
+    "Fluke7341":  {"cmd": "*VER",  "match": "ver.7341,1.08", "lines": 2, "baud": 2400},
+    "LaudaRP845": {"cmd": "TYPE",  "match": "RP  845",       "lines": 1, "baud": 9600},
+}
+
+claimed = set()     # ports connected to an instrument in this session, these are not probed
+found   = {}        # ports found by the last scan, by instrument name
+
+
+def portName(port):
+    """ name of port, integers are COM port numbers """
+    if isinstance(port, int) or str(port).isdigit():
+        return "COM{}".format(port)
+    return str(port)
+
+def listPorts():
+    """ returns a dict of the serial ports present, with the USB serial number of each (or None) """
+    if comports is not None:
+        return dict((info.device, info.serial_number) for info in comports())
+
+    if sys.platform.startswith("win"):
+        return dict(("COM{}".format(n), None) for n in range(1, 13))
+    return dict((port, None) for port in glob.glob("/dev/ttyUSB*") + glob.glob("/dev/ttyACM*"))
+
+def probe(port, names=None):
+    """ returns the name of the instrument on port (among names, default all), or None """
+    names = sorted(names or SIGNATURES)
+    for baud in sorted(set([SIGNATURES[name]["baud"] for name in names]), reverse=True):
+        try:
+            conn = serial.Serial(port=port, baudrate=baud, timeout=PROBE_TIMEOUT, rtscts=True,
+                                 write_timeout=PROBE_TIMEOUT)
+        except (ValueError, serial.SerialException):
+            return None
+
+        try:
+            for name in names:
+                sig = SIGNATURES[name]
+                if sig["baud"] != baud:
+                    continue
+                conn.reset_input_buffer()
+                res = SerialRequest(conn, sig["cmd"] + ENDL, PROBE_TIMEOUT, 0.1, lines=sig["lines"]).wait()
+                if sig["match"] in res:
+                    return name
+        except serial.SerialException:
+            return None
+        finally:
+            conn.close()
+
+    return None
+
+def scan(ports):
+    """ probe ports in parallel, returns a dict of the instruments found {name: port} """
+    ports = [port for port in ports if port not in claimed]
+    if not ports:
+        return {}
+
+    pool = ThreadPool(len(ports))
+    try:
+        names = pool.map(probe, ports)
+    finally:
+        pool.close()
+
+    return dict((name, port) for name, port in zip(names, ports) if name)
+
+def findPort(name, silent=False):
+    """ returns the port instrument name is connected to, or None if it is not found """
+    cfg = configparser.ConfigParser()
+    cfg.read(CONFIG_FILE)
+    cache = readCache()
+    ports = listPorts()
+
+    # candidates which are checked one at a time before scanning all ports
+    candidates = [port for port, serialNumber in ports.items() if cache["serials"].get(serialNumber) == name]
+    if not candidates and name in cache["ports"]:
+        candidates.append(cache["ports"][name])
+    if name in cfg and "Port" in cfg[name]:
+        candidates.append(portName(cfg[name]["Port"]))
+    if name in found:
+        candidates.insert(0, found.pop(name))
+
+    port = None
+    for candidate in candidates:
+        if candidate not in claimed and probe(candidate, [name]) == name:
+            port = candidate
+            break
+
+    if port is None:
+        if not silent:
+            print("Searching {} serial ports for {} ...".format(len(ports), name))
+        found.update(scan(sorted(set(ports) - set(candidates))))
+        port = found.pop(name, None)
+
+    if port is None:
+        return None
+
+    # remember the instruments found for next time
+    for other, otherPort in list(found.items()) + [(name, port)]:
+        if ports.get(otherPort):
+            cache["serials"][ports[otherPort]] = other
+        cache["ports"][other] = otherPort
+    writeCache(cache)
+
+    if name in cfg and cfg[name].get("Port") != port:
+        cfg[name]["Port"] = port
+        with open(CONFIG_FILE, "w") as cfgFile:
+            cfg.write(cfgFile)
+
+    return port
+
+def claim(port):
+    """ mark port as in use, so it is not probed while searching for other instruments """
+    claimed.add(portName(port))
+
+def release(port):
+    claimed.discard(portName(port))
+
+def readCache():
+    if os.path.exists(CACHE_FILE):
+        try:
+            with open(CACHE_FILE) as f:
+                return json.load(f)
+        except ValueError:
+            pass
+    return {"serials": {}, "ports": {}}
+
+def writeCache(cache):
+    with open(CACHE_FILE, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
@@ -0,0 +1,95 @@
+"""
+Fixed size windows of readings with constant time statistics, used to decide when
+readings have reached equilibrium (see Equilibrium.py and
+thermistorCalibrate.py)
+"""
+from collections import deque
+
+import numpy as np
+
+
+class RingBuffer():
+    """
+    Holds the last size readings (initially zeros). The mean and standard deviation of
+    the whole buffer are updated with each reading (Welford's method over a sliding
+    window), so getAverage and getSTD take constant time for any buffer size.
+    If channels is given, each reading is an array of one value per channel and the
+    statistics are arrays with one value per channel
+    """
+
+    def __init__(self, size, channels=None):
+        self.size    = size
+        self.buffer  = np.zeros(size if channels is None else (size, channels))
+        self.pointer = 0
+        self.count   = 0
+        self.mean    = 0.0 if channels is None else np.zeros(channels)
+        self.m2      = 0.0 if channels is None else np.zeros(channels)  # sum of squared differences from the mean
+
+    def update(self, value):
+        old = self.buffer[self.pointer].copy()
+        self.buffer[self.pointer] = value
+        self.pointer = (self.pointer + 1) % self.size
+        self.count  += 1
+
+        # replace old by value in the running mean and sum of squares
+        value     = np.asarray(value, dtype=float) if self.buffer.ndim > 1 else value
+        oldMean   = self.mean
+        self.mean = oldMean + (value - old) / self.size
+        self.m2   = self.m2 + (value - old) * (value - self.mean + old - oldMean)
+
+        # recalculate once per pass through the buffer, so rounding errors do not accumulate
+        if self.pointer == 0:
+            self.mean = self.buffer.mean(axis=0)
+            self.m2   = ((self.buffer - self.mean) ** 2).sum(axis=0)
+
+    def reset(self):
+        self.count   = 0
+
+    def getAverage(self, silent=True):
+        if self.count < self.size:
+            if not silent:
+                print("[WARNING] Buffer has not been filled completely: [{}/{}]".format(self.count, self.size))
+        return self.mean
+
+    def getSTD(self):
+        return np.sqrt(np.maximum(self.m2, 0.0) / self.size)
+
+
+class WindowExtremes():
+    """
+    Minimum and maximum of the last size values, in constant (amortized) time.
+    The values are split into blocks of size: the window is the end of the previous
+    block, whose suffix extremes are computed once the block is full, and the start of
+    the current block, whose extremes are updated with each value.
+    The window initially holds size copies of initial. If channels is given, each value
+    is an array of one value per channel and min and max return arrays
+    """
+
+    def __init__(self, size, initial=0.0, channels=None):
+        shape = (size,) if channels is None else (size, channels)
+        self.size    = size
+        self.block   = np.zeros(shape)                  # values of the current block
+        self.pointer = 0                                # number of values in the current block
+        self.mins    = np.full(shape, float(initial))   # mins[i] is the minimum of the previous block from i on
+        self.maxs    = np.full(shape, float(initial))
+        self.blockMin = np.full(shape[1:], np.inf)      # extremes of the current block
+        self.blockMax = np.full(shape[1:], -np.inf)
+
+    def update(self, value):
+        self.block[self.pointer] = value
+        self.blockMin = np.minimum(self.blockMin, value)
+        self.blockMax = np.maximum(self.blockMax, value)
+        self.pointer += 1
+
+        if self.pointer == self.size:
+            self.mins = np.minimum.accumulate(self.block[::-1], axis=0)[::-1]
+            self.maxs = np.maximum.accumulate(self.block[::-1], axis=0)[::-1]
+            self.pointer  = 0
+            self.blockMin = np.full_like(self.blockMin, np.inf)
+            self.blockMax = np.full_like(self.blockMax, -np.inf)
+
+    def min(self):
+        return np.minimum(self.mins[self.pointer], self.blockMin)
+
+    def max(self):
+        return np.maximum(self.maxs[self.pointer], self.blockMax)
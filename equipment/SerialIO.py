@@ -0,0 +1,131 @@
+"""
+Non-blocking serial I/O shared by the serial instrument classes (Fluke1502A,
+Fluke7341 and LaudaRP845)
+
+A SerialRequest sends one command and collects the response without blocking:
+each call to poll() reads whatever bytes are waiting and returns True once the
+response is complete.  If the number of lines in the response is known, the
+response is complete as soon as the last line terminator arrives; otherwise (or
+if fewer lines arrive) it ends when the instrument stops sending.  This allows a
+single loop to talk to several instruments at once without threads, for example to read two baths at the same time:
+
+    upper, lower = runAll([bathUpper.getBathTempAsync(), bathLower.getBathTempAsync()])
+
+Each instrument class provides *Async versions of its common read commands, and
+its blocking methods simply wait for the corresponding request.
+
+Only one request at a time may be in progress on an instrument. To read several
+values from each instrument, use requests that send all their commands at once
+(e.g. LaudaRP845.queryManyAsync) and wait for them with runAll.
+"""
+import re
+import time
+
+POLL_INTERVAL = 0.005   # time (s) to sleep between polling requests
+
+
+class SerialRequest(object):
+    """
+    Sends a command over a serial connection and collects the response.  The
+    response is complete once it holds the expected number of lines (each ending
+    with eol), once no bytes have arrived for timeoutConsecutive seconds, or if no
+    response has started timeoutInit seconds after the command was sent.
+    parse is applied to the raw response to give the result.  If stats is given,
+    the response time is recorded in it
+    """
+
+    def __init__(self, conn, cmd, timeoutInit, timeoutConsecutive, parse=None,
+                 lines=None, eol="\n", stats=None):
+        self.conn   = conn
+        self.cmd    = cmd
+        self.parse  = parse
+        self.lines  = lines
+        self.eol    = eol
+        self.stats  = stats
+        self.timeoutInit        = timeoutInit
+        self.timeoutConsecutive = timeoutConsecutive
+        self.framed = False         # True if the response ended with the expected line
+
+        self.response = ""
+        self.result   = None
+        self.done     = False
+        self.tLast    = None        # time the last byte was received
+
+        if cmd is not None:
+            self.conn.write(bytearray(cmd))
+        self.tStart = time.time()
+
+    def poll(self):
+        """ read waiting bytes without blocking, returns True once the response is complete """
+        if self.done:
+            return True
+
+        now = time.time()
+        waiting = self.conn.in_waiting
+        if waiting:
+            self.response += str(self.conn.read(waiting))
+            self.tLast = now
+            if self.lines and self.response.count(self.eol) >= self.lines:
+                self.framed = True
+                self._finish()
+        elif self.tLast is None:
+            if now - self.tStart > self.timeoutInit:
+                self._finish()
+        elif now - self.tLast > self.timeoutConsecutive:
+            self._finish()
+
+        return self.done
+
+    def wait(self):
+        """ block until the response is complete, and return the result """
+        while not self.poll():
+            time.sleep(POLL_INTERVAL)
+        return self.result
+
+    def _finish(self):
+        self.done   = True
+        self.result = self.response
+        if self.stats is not None and self.cmd is not None:
+            self.stats.record(self.cmd, time.time() - self.tStart, self.framed)
+        if self.parse:
+            self.result = self.parse(self.response)
+
+
+class LatencyStats(object):
+    """
+    Response times of the commands sent to an instrument.  Commands are grouped by
+    name, ignoring values (e.g. 'out sp 00 12.50' is counted as 'out sp 00')
+    """
+
+    def __init__(self):
+        self.commands = {}
+
+    @staticmethod
+    def key(cmd):
+        cmd = cmd.strip()
+        return " ".join(re.split(r"[\s=]", cmd)[:3]) if " " in cmd else cmd.split("=")[0]
+
+    def record(self, cmd, latency, framed=True):
+        key = self.key(cmd)
+        n, total, fastest, slowest, timeouts = self.commands.get(key, (0, 0.0, latency, latency, 0))
+        self.commands[key] = (n + 1, total + latency, min(fastest, latency), max(slowest, latency),
+                              timeouts + (not framed))
+
+    def reset(self):
+        self.commands = {}
+
+    def report(self):
+        """ return a table of response times (s) for each command """
+        lines = ["{:<12} {:>6} {:>8} {:>8} {:>8} {:>9}".format("command", "count", "mean", "min", "max", "timeouts")]
+        for key in sorted(self.commands):
+            n, total, fastest, slowest, timeouts = self.commands[key]
+            lines.append("{:<12} {:>6} {:>8.3f} {:>8.3f} {:>8.3f} {:>9}".format(
+                key, n, total / n, fastest, slowest, timeouts))
+        return "\n".join(lines)
+
+
+def runAll(requests):
+    """ wait for several requests (on different instruments), returns their results in order """
+    while not all([request.poll() for request in requests]):
+        time.sleep(POLL_INTERVAL)
+    return [request.result for request in requests]
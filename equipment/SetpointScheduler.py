@@ -0,0 +1,124 @@
+"""
+Bath setpoint scheduling for temperature steps (see Controller's RAMP command)
+
+The probe temperature is modelled as a first-order lag behind the bath setpoint S,
+
+    T[k+1] - T[k] = (S - T[k]) * (1 - exp(-dt / tau))
+
+and the time constant tau is fitted online from the probe readings. Once tau is known,
+each step to a new target starts with a brief overshoot: the bath is set beyond the
+target (by gain times the step size, at most maxOvershoot degrees and never outside
+tempMin..tempMax) for the time the model needs to bring the probe to the target, and
+is then set to the target itself. Until tau is known (e.g. on the first step) the bath
+is simply set to the target, which gives the baseline settling time.
+"""
+import math
+
+
+class SetpointScheduler():
+
+    def __init__(self, tempMin, tempMax, gain=0.5, maxOvershoot=2.0, minError=0.2,
+                 forget=0.995, minSamples=10):
+        self.tempMin      = tempMin
+        self.tempMax      = tempMax
+        self.gain         = gain
+        self.maxOvershoot = maxOvershoot
+        self.minError     = minError        # readings closer than this to the setpoint are not fitted
+        self.forget       = forget          # weight of older readings in the fit, per reading
+        self.minSamples   = minSamples
+
+        # weighted sums for the least squares fit of 1 - exp(-dt / tau)
+        self.sxx = 0.0
+        self.sxy = 0.0
+        self.sdt = 0.0
+        self.n   = 0.0
+
+        self.last         = None            # (time, temperature, bath setpoint) of the last reading
+        self.bathSetpoint = None
+        self.target       = None
+        self.step         = 0.0
+        self.overshoot    = 0.0             # overshoot of the current step
+        self.stepStart    = 0
+        self.switchTime   = None            # time the overshoot ends, None if not overshooting
+        self.steps        = []              # (target, step, overshoot, settling time) of each step
+
+    def getTau(self):
+        """ returns the fitted time constant (s), or None if there are not enough readings """
+        if self.n < self.minSamples or self.sxx == 0:
+            return None
+        a = self.sxy / self.sxx
+        if not 0 < a < 1:
+            return None
+        return -(self.sdt / self.n) / math.log(1 - a)
+
+    def start(self, target, temp, t):
+        """ start a step to target from probe temperature temp at time t, returns the bath setpoint to use """
+        self.target     = target
+        self.stepStart  = t
+        self.switchTime = None
+        self.last       = None
+        self.step       = 0.0 if temp is None or math.isnan(temp) else target - temp
+        setpoint        = target
+
+        tau = self.getTau()
+        if tau is not None and abs(self.step) > self.minError:
+            overshoot = max(-self.maxOvershoot, min(self.maxOvershoot, self.gain * self.step))
+            setpoint  = min(max(target + overshoot, self.tempMin), self.tempMax)
+
+            if (setpoint - target) * self.step > 0:
+                # time for the model to bring the probe from temp to target with the bath at setpoint
+                self.switchTime = t + tau * math.log((setpoint - temp) / (setpoint - target))
+            else:
+                setpoint = target
+
+        self.overshoot    = setpoint - target
+        self.bathSetpoint = setpoint
+        return setpoint
+
+    def update(self, t, temp):
+        """
+        Add a probe reading taken at time t. Returns the new bath setpoint when the
+        overshoot ends, otherwise None
+        """
+        if temp is None or math.isnan(temp):
+            return None
+
+        # fit only pairs of readings with the same setpoint, far enough from it
+        if self.last is not None and self.last[2] == self.bathSetpoint:
+            t0, temp0, setpoint = self.last
+            x = setpoint - temp0
+            if abs(x) > self.minError and t > t0:
+                self.sxx = self.forget * self.sxx + x * x
+                self.sxy = self.forget * self.sxy + x * (temp - temp0)
+                self.sdt = self.forget * self.sdt + (t - t0)
+                self.n   = self.forget * self.n + 1
+        self.last = (t, temp, self.bathSetpoint)
+
+        if self.switchTime is not None and (t >= self.switchTime or (temp - self.target) * self.step >= 0):
+            self.switchTime   = None
+            self.bathSetpoint = self.target
+            return self.target
+        return None
+
+    def isActive(self):
+        """ True while overshooting """
+        return self.switchTime is not None
+
+    def finish(self, t):
+        """ the probe has reached equilibrium at time t, returns the settling time of the step """
+        settling = t - self.stepStart
+        self.steps.append((self.target, self.step, self.overshoot, settling))
+        return settling
+
+    def report(self):
+        """ return the settling time (s) of each step, and the mean with and without overshoot """
+        lines = ["{:>8} {:>8} {:>9} {:>9}".format("target", "step", "overshoot", "settling")]
+        for target, step, overshoot, settling in self.steps:
+            lines.append("{:>8.3f} {:>8.3f} {:>9.3f} {:>9.0f}".format(target, step, overshoot, settling))
+
+        for label, steps in [("baseline", [s for s in self.steps if s[2] == 0]),
+                             ("overshoot", [s for s in self.steps if s[2] != 0])]:
+            if steps:
+                lines.append("{} mean settling time: {:.0f} s over {} steps".format(
+                    label, sum([s[3] for s in steps]) / len(steps), len(steps)))
+        return "\n".join(lines)
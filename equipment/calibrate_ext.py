@@ -11,6 +11,7 @@ from Fluke7341      import Fluke7341
 from Fluke1502A     import Fluke1502A
 from pyEmail        import Emailer
 from ColumnUtils    import getChannels, getChannelName
+from DataLog        import CsvLogWriter
 
 port_up   =  9            # Which port to connect to for upper bath
 port_low  =  12 # Which port to connect to for lower bath
@@ -61,12 +62,10 @@ if not bathLower.connect(port=port_low):
 connected.append(bathLower)
 
 # Prepare files for writing
-commonHdrs = 'Timestamp,upperExtTemp,lowerExtTemp,probeTemp,bathTemp'
+commonHdrs = ['Timestamp', 'upperExtTemp', 'lowerExtTemp', 'probeTemp', 'bathTemp']
 
 # Write resistances file
-output = open(filename, "w")
-output.write("{}\n".format(commonHdrs))
-output.close()
+log = CsvLogWriter(filename, commonHdrs)
 
 print('delaying {} seconds'.format(initDelay))
 time.sleep(initDelay)
@@ -75,7 +74,7 @@ time.sleep(initDelay)
 print('start recording')
 for t in range(0, nreads*readDelay, readDelay):
     t0 = time.time()
-    currentTime = datetime.datetime.now().isoformat()
+    currentTime = time.time()
 
 
     # read external monitors
@@ -90,11 +89,11 @@ for t in range(0, nreads*readDelay, readDelay):
 
     # write data (resistances)
     print('Ext1: {}, Ext2: {}, Probe: {},Bath: {}'.format(Text_up, Text_low, probeTemp, bathTemp))
-    with open("{}".format(filename), "a") as output:
-        output.write("{},{},{},{},{}\n".format(currentTime, Text_up, Text_low, probeTemp, bathTemp))
+    log.write(currentTime, [Text_up, Text_low, probeTemp, bathTemp])
 
     # wait until next measurement instant
     time.sleep(readDelay - (time.time() - t0))
 
 # disconnect connected devices
 map(lambda x: x.disconnect(), connected)
+log.close()
@@ -10,6 +10,7 @@ from Fluke7341      import Fluke7341
 from Fluke1502A     import Fluke1502A
 from pyEmail        import Emailer
 from ColumnUtils    import getChannels, getChannelName
+from DataLog        import openLog, exportCsv, FORMATS
 
 validChannels = range(101, 121) + range(201, 221) + range(301, 321)
 
@@ -47,6 +48,8 @@ parser.add_argument('--idelay',   default=initDelay, type=int,   help="Time (s)
 
 parser.add_argument('--channels', default=channelList,           help="List of DAQ channels to read, see code for detailed documentation on format")
 parser.add_argument('--filename', help="Filename of output csv file (.csv extention added automatically)")
+parser.add_argument('--format',   default="csv", choices=FORMATS, help="Output file format. 'binary' writes chunked float64 logs (.npl directories) that load much faster than csv")
+parser.add_argument('--hwscan', action='store_const', default=False, const=True, help="Let the DAQ time the reads at each setpoint (rdelay apart) and buffer them, instead of timing them from this script")
 parser.add_argument('--eta', action='store_const', default=False, const=True, help="Print estimated time and exit without running experiment")
 
 parser.add_argument('--email',    default="",                    help="Send results to this email")
@@ -108,10 +111,10 @@ else:
     timestamp = datetime.datetime.now().isoformat().split('.')[0].replace(':', '_')
     filename  = "{}".format(timestamp)
 
+headers = ["Time", "Setpoint", "ProbeTemp", "BathTemp"] + [channelNames[str(channel)] for channel in sorted(channels)]
+logs = {}
 for mode in ["res", "avg", "std"]:
-    output = open("{}_{}.csv".format(filename, mode), "w")
-    output.write("Time,Setpoint,ProbeTemp,BathTemp,{}\n".format(",".join([channelNames[str(channel)] for channel in sorted(channels)])))
-    output.close()
+    logs[mode] = openLog("{}_{}".format(filename, mode), headers, fmt=args.format)
 
 bath.setSetpoint(setpoints[0])
 time.sleep(initDelay)
@@ -123,26 +126,39 @@ for setpoint in setpoints:
     probeTemps = []
     bathTemps  = []
     daqResults = []
-    measureStartTime = datetime.datetime.now().isoformat() # time that first measurement in a batch is taken
-
-    for i in range(nReads):
-        t0 = time.time()
-        print "\r  Measuring DAQ [{}/{}]".format(i+1, nReads),
-        currentTime = datetime.datetime.now().isoformat()
-
-        probeTemp = float(probe.readTemp())
-        probeTemps.append(probeTemp)
-
-        bathTemp  = float(bath.readTemp())
-        bathTemps.append(bathTemp)
-
-        daqVals   = daq.readResistances(channelList)
-        daqResults.append(daqVals)
-        daqVals   = ",".join(map(str, daqVals))
-        with open("{}_res.csv".format(filename), "a") as output:
-            output.write("{},{},{},{},{}\n".format(currentTime, setpoint, probeTemp, bathTemp, daqVals))
-
-        time.sleep(readDelay - (time.time() - t0))
+    measureStartTime = time.time() # time that first measurement in a batch is taken
+
+    # with --hwscan the DAQ scans on its own timer, each read waits for the next scan and
+    # the probe and bath are read as soon as it arrives
+    if args.hwscan:
+        daq.startScan(channelList, readDelay, nReads)
+
+    try:
+        for i in range(nReads):
+            t0 = time.time()
+            print "\r  Measuring DAQ [{}/{}]".format(i+1, nReads),
+            if args.hwscan:
+                scanTimes, scanValues = daq.fetchScans(minScans=1, maxScans=1)
+                currentTime, daqVals = scanTimes[0], scanValues[0]
+            else:
+                currentTime = time.time()
+
+            probeTemp = float(probe.readTemp())
+            probeTemps.append(probeTemp)
+
+            bathTemp  = float(bath.readTemp())
+            bathTemps.append(bathTemp)
+
+            if not args.hwscan:
+                daqVals = daq.readResistances(channelList)
+            daqResults.append(daqVals)
+            logs["res"].write(currentTime, [setpoint, probeTemp, bathTemp] + list(daqVals))
+
+            if not args.hwscan:
+                time.sleep(readDelay - (time.time() - t0))
+    finally:
+        if args.hwscan:
+            daq.stopScan()
 
     # compute mean and std of each column
     probeMean = np.mean(probeTemps)
@@ -156,15 +172,8 @@ for setpoint in setpoints:
 
 
 
-    # convert results to strings
-    daqMeans  = ",".join(map(str, daqMeans))
-    daqStds   = ",".join(map(str, daqStds))
-
-    with open("{}_avg.csv".format(filename), "a") as output:
-        output.write("{},{},{},{},{}\n".format(measureStartTime, setpoint, probeMean, bathMean, daqMeans))
-
-    with open("{}_std.csv".format(filename), "a") as output:
-        output.write("{},{},{},{},{}\n".format(measureStartTime, setpoint, probeStd, bathStd, daqStds))
+    logs["avg"].write(measureStartTime, [setpoint, probeMean, bathMean] + list(daqMeans))
+    logs["std"].write(measureStartTime, [setpoint, probeStd, bathStd] + list(daqStds))
 
     print ""
 
@@ -175,10 +184,17 @@ bath.disconnect()
 probe.disconnect()
 daq.disconnect()
 
+for mode in logs:
+    logs[mode].close()
+
 if args.email:
     cfg  = configparser.ConfigParser()
     cfg.read("lab.cfg")
     fromEmail = cfg["Email"]["address"]
     fromPass  = cfg["Email"]["password"]
     e = Emailer(fromEmail, fromPass)
-    e.send(args.email, args.subject, ["{}_{}.csv".format(filename, mode) for mode in ["res", "avg", "std"]])
+    if args.format == "binary":
+        attachments = [exportCsv(logs[mode].filename) for mode in ["res", "avg", "std"]]
+    else:
+        attachments = [logs[mode].filename for mode in ["res", "avg", "std"]]
+    e.send(args.email, args.subject, attachments)
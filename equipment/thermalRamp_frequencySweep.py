@@ -1,31 +1,74 @@
-import subprocess
 import time
+from Agilent4395A   import Agilent4395A
+from Equilibrium    import EquilibriumMonitor
 from Fluke7341      import Fluke7341
 
+import frequencySweep
+
+# Steps the calibration bath through a list of setpoints and makes an impedance sweep
+# (see frequencySweep.py) as soon as the bath has reached equilibrium at each one.
+# The bath and analyzer stay connected for the whole ramp.
+
+SAMPLE_INTERVAL = 5         # time (s) between bath readings while waiting for equilibrium
+BUFFER_SIZE     = 30        # readings used to decide equilibrium (see Equilibrium.EquilibriumMonitor)
+TOLERANCE       = 0.1       # bath must be within this many degrees of the setpoint
+MAX_WAIT        = 3 * 3600  # max. time (s) to wait for equilibrium before sweeping anyway
+
+# Sets the bath to setpoint and waits until its temperature is steady and close to the setpoint
+# Returns the time (s) taken
+def waitForEquilibrium(bath, setpoint):
+    bath.setSetpoint(setpoint)
+    monitor = EquilibriumMonitor(BUFFER_SIZE, name="bath")
+
+    t0 = time.time()
+    t  = t0
+    while time.time() - t0 < MAX_WAIT:
+        temp = float(bath.readTemp())
+        monitor.update(temp)
+        if monitor.isEqualized() and abs(temp - setpoint) < TOLERANCE:
+            return time.time() - t0
+
+        t += SAMPLE_INTERVAL
+        time.sleep(max(0, t - time.time()))
+
+    print "[WARNING] bath did not reach equilibrium at {} C within {} s".format(setpoint, MAX_WAIT)
+    return time.time() - t0
+
 if __name__ == "__main__":
 
+    # sweep parameters (see frequencySweep.py)
+    Rs      = 50.0
+    nPoints = 201
+    f1      = 10
+    f2      = 50000000
+
+    setpoints = range(21)[::-1]
+
     bath = Fluke7341()
+    fra  = Agilent4395A()
 
     if not bath.connect():
         print "failed to connect to bath"
         exit()
 
-    for setpoint in range(21)[::-1]:
-        bath.setSetpoint(20)
-        time.sleep(3000)
+    if not fra.connect():
+        print "failed to connect to analyzer"
+        bath.disconnect()
+        exit()
 
-        print "performing sweep"
+    # the analyzer is configured once and stays connected for all sweeps
+    frequencySweep.configure(fra, nPoints, f1, f2)
 
-        args = ["python",
-            "frequencySweep.py",
-            "thermalTest_{}C".format(setpoint),
-            "50"]
-        subprocess.Popen(args).wait()
+    for setpoint in setpoints:
+        print "waiting for bath to reach {} C".format(setpoint)
+        duration = waitForEquilibrium(bath, setpoint)
+        print "equilibrium after {:.0f} s".format(duration)
+
+        print "performing sweep"
+        frequencySweep.sweep(fra, "thermalTest_{}C".format(setpoint), Rs, nPoints, f1, f2)
         print "done"
 
     bath.setSetpoint(20)
 
-
-
-
-
+    fra.disconnect()
+    bath.disconnect()
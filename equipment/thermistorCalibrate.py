@@ -1,11 +1,12 @@
 import datetime
-import math
 import sys
 import time
 
 from Keysight34972A import Keysight34972A
 from Fluke7341  import Fluke7341
 from Fluke1502A import Fluke1502A
+from RingBuffer import RingBuffer, WindowExtremes
+from Equilibrium import DriftCriterion
 
 NUM_PROBES      = 2
 PROBE_LIST      = [1, 2]
@@ -14,51 +15,20 @@ BUFFER_SIZE     = 5000
 STD_HOLD_COUNT  = 5000
 TEMP_INCREMENT  = 0.0
 
+# Early stopping: go to the next setpoint as soon as the drift of every probe's resistance over the
+# last DRIFT_WINDOW readings is below MAX_DRIFT (ohm/s) with 95% confidence, instead of waiting for
+# the STD test above. The settled resistance is then projected by fitting an exponential approach
+# to the readings since the setpoint was reached (see Equilibrium.DriftCriterion)
+EARLY_STOP      = False
+DRIFT_WINDOW    = 120
+MAX_DRIFT       = 0.002
+
 """ QUICK VALUES FOR TESTING
 SAMPLE_INTERVAL = 2
 BUFFER_SIZE = 5
 STD_HOLD_COUNT = 5
 """
 
-class RingBuffer():
-    
-    def __init__(self, size):
-        self.size    = size
-        self.buffer  = [0] * size
-        self.pointer = 0
-        self.count   = 0
-        """
-        for i in range(size):
-            if i % 2:
-                self.buffer[i] = -1e16
-            else:
-                self.buffer[i] =  1e16
-        """
-
-    def update(self, value):
-        self.buffer[self.pointer] = value
-        self.pointer = (self.pointer + 1) % self.size
-        self.count += 1
-        
-    def reset(self):
-        self.count   = 0
-
-    def getAverage(self, silent=True):
-        if self.count < self.size:
-            if not silent:
-                print "[WARNING] Buffer has not been filled completely: [{}/{}]".format(self.count, self.size)
-        return sum(self.buffer) / self.size
-        
-    def getSTD(self):
-        std = 0
-        avg = self.getAverage()
-        for i in range(self.size):
-            std += (self.buffer[i] - avg) ** 2
-        std /= self.size
-        return math.sqrt(std)
-        
-    
-
 def thermalRamp(start, end, increment, daq, bath, thermalProbe):
 
     setpoint = start
@@ -70,15 +40,20 @@ def thermalRamp(start, end, increment, daq, bath, thermalProbe):
     
     probeTitles = ",".join(["probe {}".format(i) for i in PROBE_LIST])
     averageTitles = ",".join(["average {}".format(i) for i in PROBE_LIST])
+    settledTitles = ",".join(["settled {}".format(i) for i in PROBE_LIST])
     f = open(csvFile, "w")
-    f.write("time, elapsed time, setpoint, bath temp, probe temp,{},{}\n".format(probeTitles, averageTitles))
+    # the last columns are only written at equilibrium: the settled resistances (buffer averages,
+    # or projected with EARLY_STOP), the time taken and saved (s), and the test that ended the wait
+    f.write("time, elapsed time, setpoint, bath temp, probe temp,{},{},{}, equilibrium time, time saved, method\n".format(
+        probeTitles, averageTitles, settledTitles))
     f.close()
     
     # create ring buffer for each thermistor
     buffers = [RingBuffer(BUFFER_SIZE) for i in range(NUM_PROBES)]
     minSTDs = [1e9 for i in range(NUM_PROBES)]
-    maxSTDs = [[0] * STD_HOLD_COUNT for i in range(NUM_PROBES)]
+    maxSTDs = [WindowExtremes(STD_HOLD_COUNT, 0) for i in range(NUM_PROBES)]
     counts  = [0 for i in range(NUM_PROBES)]
+    drifts  = [DriftCriterion(DRIFT_WINDOW, MAX_DRIFT, name="probe {}".format(i)) for i in PROBE_LIST]
     
     done            = False
     numMeasurements = 0
@@ -105,7 +80,7 @@ def thermalRamp(start, end, increment, daq, bath, thermalProbe):
                     print "new lowest std"
                     minSTDs[i] = std
                     counts[i]  = 0
-                elif int(std) > max(maxSTDs[i]):
+                elif int(std) > maxSTDs[i].max():
                     print "std too high"
                     counts[i]  = 0
                 else:
@@ -114,12 +89,15 @@ def thermalRamp(start, end, increment, daq, bath, thermalProbe):
                         counts[i] += 1
                     else:
                         print "need more measurements"
-                maxSTDs[i] = maxSTDs[i][1:] + [int(std)]
+                maxSTDs[i].update(int(std))
+                drifts[i].update(resistances[i], t1)
                 
             if abs(bathTemp - setpoint) > 0.01:
                 print "bathTemp ({}) != setpoint ({})".format(bathTemp, setpoint)
                 bath.setSetpoint(setpoint)
                 counts = [0 for count in counts]
+                for drift in drifts:
+                    drift.reset()
                 
             # check if any probes are not at equilibrium
             allEqualized = True
@@ -127,6 +105,7 @@ def thermalRamp(start, end, increment, daq, bath, thermalProbe):
                 if counts[i] < STD_HOLD_COUNT:
                     allEqualized = False
                     break
+            stopEarly = EARLY_STOP and not allEqualized and all([drift.isEqualized() for drift in drifts])
                     
             r = ",".join([str(i) for i in resistances])
             a = ",".join([str(buffer.getAverage()) for buffer in buffers])
@@ -142,10 +121,18 @@ def thermalRamp(start, end, increment, daq, bath, thermalProbe):
             f.write("{},{},{},{},{},{},{}".format(timestamp, elapsedTime, setpoint, bathTemp, probeTemp, r, a))
             
             # go to next setpoint
-            if allEqualized and numMeasurements > BUFFER_SIZE:
+            if (allEqualized and numMeasurements > BUFFER_SIZE) or stopEarly:
                 print "equalized"
                 
-                f.write(",{}".format(",".join([str(buffer.getAverage()) for buffer in buffers])))
+                if stopEarly:
+                    # lower bound on the time the STD test would still have taken
+                    remaining = max(0, BUFFER_SIZE + 1 - numMeasurements) + STD_HOLD_COUNT - min(counts)
+                    method    = "drift"
+                    f.write(",{}".format(",".join([str(drift.getSettledValue()) for drift in drifts])))
+                else:
+                    remaining = 0
+                    method    = "std"
+                    f.write(",{}".format(",".join([str(buffer.getAverage()) for buffer in buffers])))
                 
                 if abs(setpoint - end) < 0.001:
                     done = True
@@ -155,12 +142,13 @@ def thermalRamp(start, end, increment, daq, bath, thermalProbe):
                 
                 for i in range(NUM_PROBES):
                     buffers[i].reset()
+                    drifts[i].reset()
                     counts[i] = 0
                     
                 numMeasurements = 0
                 
                 equilibriumTime = time.time() - equilibriumTime
-                f.write(",{}".format(equilibriumTime))
+                f.write(",{},{},{}".format(equilibriumTime, remaining * SAMPLE_INTERVAL, method))
                 equilibriumTime = time.time()
  
             f.write("\n")
@@ -28,12 +28,23 @@ def write(cmd):
 def query(cmd):
     return analyzer.query(cmd)
 
+# WAIT: blocks until all pending operations (configuration, sweeps) are finished, '*OPC?' is
+# only answered once they are done. timeout in seconds
+def wait(timeout=None):
+    previous = analyzer.timeout
+    if timeout is not None:
+        analyzer.timeout = 1000 * timeout
+    try:
+        query('*OPC?')
+    finally:
+        analyzer.timeout = previous
+
 def disconnect(): # To close the connection before script ends
     analyzer.close()
 
 # GPIB ID string returned by the '*IDN?' query (refer section I-1 in 4395A programming manual)
 print 'Expected GPIB ID of analyzer: HEWLETT-PACKARD,4395A,MY41101925,REV1.12'
-print 'Actual GPIB ID of analyzer: ' query('*IDN?')
+print 'Actual GPIB ID of analyzer: ' + query('*IDN?')
 
 write('*RST') # resets the analyzer to its default values
 write('*CLS') # clears error queues and various registers
@@ -81,7 +92,7 @@ print 'Configuring analyzer for V2/V1 measurement(s)'
 commandList = commands.split('\n')
 for cmd in commandList:
     write(cmd.strip())
-time.sleep(10)
+wait()
 
 for count in counts:
     # Get sweep duration
@@ -94,12 +105,10 @@ for count in counts:
         t = 180
     print "Total sweep time for V21 measurement {} is: {}".format(count,t)
 
-    # Make measurement(s)
-    t0 = time.time()
+    # Make measurement(s), returns as soon as the sweeps are finished
     write("NUMG {}".format(avgfct))
     print "waiting"
-    while time.time() < t0 + t + 2:
-        time.sleep(1)
+    wait(t + 10)
 
     # Read measurement data from analyzer
     for fmt in fmts:
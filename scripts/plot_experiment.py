@@ -9,6 +9,7 @@ if __name__ == '__main__':
     sys.path.append(eqp)
 
     from ColumnPlot import ColumnPlotter
+    from ColumnUtils import ColumnExperiment
     import argparse
     import configparser
 
@@ -20,9 +21,15 @@ if __name__ == '__main__':
     parser.add_argument('--mean',    action='store_true',   help="make a mean plot")
     parser.add_argument('--cont',    action='store_true',   help="make a contour plot")
     parser.add_argument('--set_bnds',action='store_true',   help="use target temperatures for mean plot boundaries", default=False)
+    parser.add_argument('--pos',     action='store_true',   help="plot the last temperature of each thermistor at its position")
+    parser.add_argument('--cfg',     type=str,   help="path to columnconfig directory (needed for --pos)")
     args = parser.parse_args()
 
-    P = ColumnPlotter(args.data)
+    geometry = None
+    if args.cfg:
+        geometry = ColumnExperiment.readConfig(args.cfg)["geometry"]
+
+    P = ColumnPlotter(args.data, geometry)
 
     if args.mean:
         P.meanPlot(use_set_bndry=args.set_bnds)
@@ -30,3 +37,6 @@ if __name__ == '__main__':
     if args.cont:
         P.contourPlot()
 
+    if args.pos:
+        P.positionPlot()
+
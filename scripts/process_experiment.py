@@ -1,27 +1,119 @@
 import sys
+import time
+from glob import glob
 from os import path
 
+fp = path.dirname(path.realpath(__file__))
+eqp = path.join(path.dirname(fp), "equipment")
+sys.path.append(eqp)
 
-if __name__ == '__main__':
+from ColumnUtils import ColumnExperiment
+
+RAW_PATTERNS = ["*_tmp.csv", "*_tmp.npl"]     # raw temperature data files in a directory
+
+config  = None      # contents of the configuration directory, read once and shared by all files
+options = None      # command line arguments
+
+
+def findRawData(paths):
+    """
+    raw data files for a list of files, directories and glob patterns. Each experiment
+    (output directory) is processed from one file only: a binary log is preferred to a
+    csv export of it, and temperature data (*_tmp) to other files of the experiment
+    """
+    files = []
+    for p in paths:
+        if path.isdir(p) and not p.rstrip("/\\").endswith(".npl"):
+            for pattern in RAW_PATTERNS:
+                files += sorted(glob(path.join(p, pattern)))
+        elif path.exists(p):
+            files.append(p)
+        else:
+            files += sorted(glob(p))
+
+    experiments = {}
+    for f in files:
+        f = f.rstrip("/\\")
+        output_dir = path.realpath(ColumnExperiment.outputDir(f))
+        experiments.setdefault(output_dir, {})[path.realpath(f)] = f
+
+    selected = []
+    for output_dir in sorted(experiments):
+        candidates = sorted(experiments[output_dir].values(),
+                            key=lambda f: (not f.endswith(".npl"), "_tmp." not in path.basename(f), f))
+        for f in candidates[1:]:
+            print("skipping {}: same experiment as {}".format(f, candidates[0]))
+        selected.append(candidates[0])
+    return selected
+
+def initWorker(cfg, args):
+    global config, options
+    config  = cfg
+    options = args
 
-    fp = path.dirname(path.realpath(__file__))
-    eqp = path.join(path.dirname(fp), "equipment")
-    sys.path.append(eqp)
+def processExperiment(raw_data):
+    """ process one raw data file, returns the file, the time taken (s) and an error message or None """
+    t0 = time.time()
+    error = None
+    try:
+        C = ColumnExperiment(raw_data = raw_data, cfg_dir = options.cfg, soil_height = options.sh, config = config)
+        C.setOverwrite(options.f)
+        C.setIncremental(options.i)
+        C.setBlockSize(options.block)
+        C.processColumn()
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    return raw_data, time.time() - t0, error
+
+
+if __name__ == '__main__':
 
-    from ColumnUtils import ColumnExperiment
     import argparse
-    import configparser
+    from multiprocessing import Pool, cpu_count
 
     parser = argparse.ArgumentParser(description="Process raw data from column experiment",
                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     parser.add_argument('--sh',  type=float, help="soil height in cm")
-    parser.add_argument('--rd',  type=str,   help="path to raw temperature data file")
+    parser.add_argument('--rd',  type=str,   nargs='+',
+                        help="path to raw temperature data file(s), or directories or glob patterns of them")
     parser.add_argument('--cfg', type=str,   help="path to columnconfig directory")
     parser.add_argument('-f',    action='store_true',   help="overwrite existing directory")
+    parser.add_argument('-i',    action='store_true',   help="incremental: only process readings added since the last run")
+    parser.add_argument('--block', type=int, default=None, help="process this many readings at a time, to limit memory use")
+    parser.add_argument('-j',    type=int, default=cpu_count(), help="number of files to process in parallel")
 
     args = parser.parse_args()
 
-    C = ColumnExperiment(raw_data = args.rd, cfg_dir = args.cfg, soil_height = args.sh)
-    C.setOverwrite(args.f)
-    C.processColumn()
\ No newline at end of file
+    files = findRawData(args.rd)
+    if not files:
+        print("no raw data files found")
+        exit(1)
+
+    cfg = ColumnExperiment.readConfig(args.cfg)
+    t0  = time.time()
+
+    results = []
+    if args.j <= 1 or len(files) == 1:
+        initWorker(cfg, args)
+        results = [processExperiment(f) for f in files]
+    else:
+        pool = Pool(min(args.j, len(files)), initializer=initWorker, initargs=(cfg, args))
+        try:
+            for result in pool.imap_unordered(processExperiment, files):
+                print("done {}/{}: {}".format(len(results) + 1, len(files), result[0]))
+                results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+
+    if len(files) > 1 or results[0][2]:
+        print("")
+        print("{:<60} {:>9}  {}".format("raw data", "time (s)", "result"))
+        for raw_data, seconds, error in sorted(results):
+            print("{:<60} {:>9.1f}  {}".format(raw_data, seconds, error or "ok"))
+        print("{} files in {:.1f} s ({:.1f} s of processing), {} failed".format(
+            len(files), time.time() - t0, sum([r[1] for r in results]), len([r for r in results if r[2]])))
+
+    if any([error for raw_data, seconds, error in results]):
+        exit(1)